@@ -0,0 +1,283 @@
+import asyncio
+import re
+import ssl
+import time
+from email_client import EmailClient, MAX_RETRY_DELAY, MESSAGE_ITEMS
+from imap_utils import UidQueue, build_message_set
+
+LITERAL_END_RE = re.compile(rb'\{(\d+)\}$')
+UNTAGGED_STATUS_RE = re.compile(rb'^(\d+) ([A-Z-]+)(?: (.*))?$', re.IGNORECASE | re.DOTALL)
+UNTAGGED_RE = re.compile(rb'^([A-Z-]+)(?: (.*))?$', re.IGNORECASE | re.DOTALL)
+RESPONSE_CODE_RE = re.compile(rb'^\[([A-Z-]+)(?: ([^\]]*))?\]', re.IGNORECASE)
+
+# SEARCH responses for very large mailboxes arrive as a single line
+STREAM_LIMIT = 32 * 1024 * 1024
+
+
+class AsyncEmailClient(EmailClient):
+    """
+    asyncio implementation of the EmailClient interface. Every IMAP method is a
+    coroutine, so many accounts can be processed concurrently on one event loop.
+    Responses are returned in the same shape imaplib produces, which lets the
+    parsing helpers inherited from EmailClient be reused unchanged.
+    """
+
+    def __init__(self, email_account):
+        super().__init__(email_account)
+        self.reader = None
+        self.writer = None
+        self._tag_counter = 0
+
+    async def connect(self):
+        try:
+            self.reader, self.writer = await asyncio.open_connection(
+                self.server, self.port, ssl=ssl.create_default_context(), limit=STREAM_LIMIT
+            )
+            self._search_cache = {}
+            self.searched_uidnext = None
+            await self._readline()  # server greeting
+            status, _ = await self._command('LOGIN', self._quote(self.email), self._quote(self.password))
+            if status != 'OK':
+                raise ConnectionError(f"LOGIN returned {status}")
+            _, untagged = await self._command('CAPABILITY')
+            self.capabilities = self._parse_capabilities(untagged.get('CAPABILITY'))
+            if 'ENABLE' in self.capabilities:
+                for extension in ('QRESYNC', 'CONDSTORE'):
+                    if extension in self.capabilities:
+                        await self._command('ENABLE', extension)
+                        break
+            status, untagged = await self._command('SELECT', self._quote(self.folder))
+            if status != 'OK':
+                raise ConnectionError(f"SELECT {self.folder} returned {status}")
+            self.mailbox_state = {
+                code.lower(): self._untagged_int(untagged, code)
+                for code in ('UIDVALIDITY', 'UIDNEXT', 'HIGHESTMODSEQ')
+            }
+            exists = untagged.get('EXISTS', [b'0'])[-1].decode()
+            self.logger.info(f"Total emails in {self.folder} for {self.email}: {exists}")
+            self._last_command = time.monotonic()
+            return True
+        except Exception as e:
+            self.logger.error(f"Connection failed for {self.email}: {str(e)}")
+            self.writer = None
+            return False
+
+    async def disconnect(self):
+        try:
+            if self.writer:
+                await self._command('CLOSE')
+                await self._command('LOGOUT')
+                self.writer.close()
+                await self.writer.wait_closed()
+        except Exception as e:
+            self.logger.error(f"Error disconnecting {self.email}: {str(e)}")
+        finally:
+            self.writer = None
+
+    async def search_uids(self, since_uid=None, since_date=None):
+        if not self.writer:
+            if not await self.connect():
+                return None
+
+        criteria = self._search_criteria(since_uid, since_date)
+        if criteria in self._search_cache:
+            self.searched_uidnext = self.mailbox_state.get('uidnext')
+            return self._search_cache[criteria]
+
+        try:
+            status, messages = await self._uid('SEARCH', criteria)
+            if status != 'OK':
+                self.logger.error(f"Search failed for {self.email}: {status}")
+                return None
+        except Exception as e:
+            self.logger.error(f"Error searching emails for {self.email}: {str(e)}")
+            return None
+
+        uids = self._uids_from_search(messages or [b''], since_uid)
+        self._search_cache[criteria] = uids
+        self.searched_uidnext = self.mailbox_state.get('uidnext')
+        return uids
+
+    async def fetch_uid_batch(self, since_uid=None, batch_size=100, start_index=0, since_date=None):
+        uids = await self.search_uids(since_uid=since_uid, since_date=since_date) or []
+        return self._slice_batch(uids, batch_size, start_index)
+
+    async def fetch_emails(self, since_date=None, since_uid=None, batch_size=100, start_index=0):
+        batch_ids, next_start_index = await self.fetch_uid_batch(
+            since_uid=since_uid, since_date=since_date, batch_size=batch_size, start_index=start_index
+        )
+        if not batch_ids:
+            return [], None
+
+        try:
+            return await self.fetch_messages(batch_ids), next_start_index
+        except Exception as e:
+            self.logger.error(f"Error fetching emails for {self.email}: {str(e)}")
+            return [], None
+
+    async def fetch_headers(self, uids, with_structure=False):
+        if not uids:
+            return []
+
+        status, msg_data = await self._uid('FETCH', build_message_set(uids), self._header_items(with_structure))
+        if status != 'OK':
+            self.logger.error(f"Header fetch failed for {self.email}: {status}")
+            return []
+        return self._headers_from_response(uids, msg_data, with_structure)
+
+    async def fetch_text_parts(self, headers, max_bytes=None):
+        sections_by_uid, uids_by_sections = self._plan_text_fetches(headers)
+
+        bodies = {}
+        for sections, uids in uids_by_sections.items():
+            items = self._text_items(sections, max_bytes)
+            status, msg_data = await self._uid('FETCH', build_message_set(uids), items)
+            if status != 'OK':
+                self.logger.error(f"Text part fetch failed for {self.email}: {status}")
+                continue
+            bodies.update(self._text_bodies_from_response(msg_data, sections, max_bytes))
+        return self._text_emails(headers, sections_by_uid, bodies)
+
+    async def fetch_messages(self, uids, parse=True):
+        if not uids:
+            return []
+
+        cached, missing = self._cache_lookup(uids)
+        fetched = []
+        if missing:
+            status, msg_data = await self._uid('FETCH', build_message_set(missing), MESSAGE_ITEMS)
+            if status != 'OK':
+                self.logger.error(f"Bulk fetch failed for {self.email}: {status}")
+            else:
+                fetched = self._messages_from_response(missing, msg_data, parse)
+                self._cache_store({e['uid']: e['raw'] for e in fetched})
+        return self._merge_cached(uids, cached, fetched, parse)
+
+    async def iter_messages(self, since_uid=None, chunk=25, uids=None):
+        if uids is None:
+            uids = await self.search_uids(since_uid=since_uid) or []
+        queue = UidQueue(uids)
+
+        while queue:
+            chunk_ids = queue.pop_batch(chunk)
+            raws, missing = self._cache_lookup(chunk_ids)
+            if missing:
+                status, msg_data = await self._uid('FETCH', build_message_set(missing), MESSAGE_ITEMS)
+                if status != 'OK':
+                    self.logger.error(f"Fetch failed for {self.email}: {status}")
+                else:
+                    raws.update(self._raw_messages(msg_data))
+                    del msg_data
+            for email_data in self._parsed_messages(chunk_ids, raws):
+                yield email_data
+
+    async def _uid(self, command, *args):
+        """
+        Run a UID command and return (status, data) like imaplib's IMAP4.uid(),
+        reconnecting and retrying it on a dropped connection like EmailClient._uid.
+        """
+        uidvalidity = self.mailbox_state.get('uidvalidity')
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self.writer is None:
+                    if not await self.connect():
+                        raise ConnectionError(f"Reconnect to {self.server} failed")
+                    if self.mailbox_state.get('uidvalidity') != uidvalidity:
+                        raise RuntimeError(f"UIDVALIDITY of {self.folder} changed during the run")
+                if time.monotonic() - self._last_command > self.keepalive_interval:
+                    await self._command('NOOP')
+                status, untagged = await self._command('UID', command, *args)
+                self._last_command = time.monotonic()
+                return status, untagged.get(command.upper(), [])
+            except (OSError, EOFError) as e:
+                if attempt == self.max_retries:
+                    raise
+                self.logger.warning(
+                    f"Connection to {self.email} lost ({str(e) or type(e).__name__}), "
+                    f"retrying UID {command.upper()} in {delay:g}s ({attempt + 1}/{self.max_retries})"
+                )
+                self._drop_connection()
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
+
+    def _drop_connection(self):
+        try:
+            if self.writer:
+                self.writer.close()
+        except Exception:
+            pass
+        self.writer = None
+
+    async def _command(self, name, *args):
+        self._tag_counter += 1
+        tag = f"A{self._tag_counter:04d}".encode()
+        line = b' '.join([tag, name.encode()] + [a if isinstance(a, bytes) else str(a).encode() for a in args])
+        self.writer.write(line + b'\r\n')
+        await self.writer.drain()
+        return await self._read_response(tag)
+
+    async def _read_response(self, tag):
+        untagged = {}
+        while True:
+            line = await self._readline()
+            if line.startswith(tag + b' '):
+                status = line[len(tag) + 1:].split(b' ', 1)[0].decode().upper()
+                return status, untagged
+            if not line.startswith(b'* '):
+                continue  # continuation requests are not used by this client
+
+            # Collect literals the way imaplib does: (head, literal) tuples then trailing text
+            parts = []
+            head = line[2:]
+            match = LITERAL_END_RE.search(head)
+            while match:
+                literal = await self.reader.readexactly(int(match.group(1)))
+                parts.append((head, literal))
+                head = await self._readline()
+                match = LITERAL_END_RE.search(head)
+            parts.append(head)
+            self._store_untagged(untagged, parts)
+
+    @staticmethod
+    def _store_untagged(untagged, parts):
+        first = parts[0][0] if isinstance(parts[0], tuple) else parts[0]
+        status_match = UNTAGGED_STATUS_RE.match(first)
+        if status_match:
+            key = status_match.group(2).decode().upper()
+            data = status_match.group(1) + (b' ' + status_match.group(3) if status_match.group(3) else b'')
+        else:
+            plain_match = UNTAGGED_RE.match(first)
+            if not plain_match:
+                return
+            key = plain_match.group(1).decode().upper()
+            data = plain_match.group(2) or b''
+            code_match = RESPONSE_CODE_RE.match(data)
+            if code_match:
+                untagged.setdefault(code_match.group(1).decode().upper(), []).append(code_match.group(2) or b'')
+
+        if isinstance(parts[0], tuple):
+            parts[0] = (data, parts[0][1])
+        else:
+            parts[0] = data
+        untagged.setdefault(key, []).extend(parts)
+
+    async def _readline(self):
+        line = await self.reader.readline()
+        if not line:
+            raise ConnectionError(f"Connection closed by {self.server}")
+        return line.rstrip(b'\r\n')
+
+    @staticmethod
+    def _untagged_int(untagged, code):
+        values = untagged.get(code)
+        if not values or not values[-1]:
+            return None
+        try:
+            return int(values[-1].split()[0])
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _quote(value):
+        return '"' + str(value).replace('\\', '\\\\').replace('"', '\\"') + '"'
@@ -1,7 +1,29 @@
 import imaplib
 import email
+import re
+import select
+import socket
+import ssl
+import time
 from email.header import decode_header
+from email.message import Message
 import logging
+from message_cache import get_cache, DEFAULT_CACHE_MB
+from imap_utils import (
+    DeflateSocket, UidQueue, build_message_set, parse_fetch_response, get_literal, get_size,
+    get_bodystructure, find_text_sections, decode_section, format_imap_date
+)
+
+HEADER_FIELDS = 'FROM SUBJECT DATE'
+# Whole messages are fetched with PEEK so reading them never sets \Seen
+MESSAGE_ITEMS = '(UID BODY.PEEK[])'
+MESSAGE_LITERAL = 'BODY[]'
+# Servers may drop an IDLE connection after 30 minutes (RFC 2177)
+IDLE_TIMEOUT = 25 * 60
+NEW_MAIL_RE = re.compile(rb'^\* \d+ EXISTS', re.IGNORECASE)
+# Errors that mean the connection is gone and the command can be retried on a new one
+CONNECTION_ERRORS = (imaplib.IMAP4.abort, OSError, EOFError)
+MAX_RETRY_DELAY = 60
 
 class EmailClient:
     def __init__(self, email_account):
@@ -9,22 +31,66 @@ class EmailClient:
         self.password = email_account['password']
         self.server = email_account['imap_server']
         self.port = email_account['imap_port']
+        self.folder = email_account.get('folder', 'INBOX')
+        # Negotiate COMPRESS=DEFLATE when the server offers it (accounts.yaml 'compress')
+        self.compress = email_account.get('compress', True)
+        # Messages over max_message_kb only get the first partial_kb of each text part
+        max_kb = email_account.get('max_message_kb')
+        self.max_message_size = int(max_kb) * 1024 if max_kb else None
+        self.partial_size = int(email_account.get('partial_kb', 64)) * 1024
+        # Reconnect attempts (with exponential backoff from retry_delay seconds)
+        # before a dropped connection fails the run
+        self.max_retries = int(email_account.get('max_retries', 5))
+        self.retry_delay = float(email_account.get('retry_delay', 2))
+        # Send a NOOP before a command if the connection has been quiet this long
+        self.keepalive_interval = float(email_account.get('keepalive_interval', 300))
+        # Raw message cache shared by all accounts that enable it (accounts.yaml
+        # 'cache'; the first such account's 'cache_mb' sets the size limit)
+        self.cache = get_cache(email_account.get('cache_mb', DEFAULT_CACHE_MB)) if email_account.get('cache') else None
+        self._last_command = 0.0
         self.mail = None
+        self._search_cache = {}
+        self.capabilities = set()
+        # UIDVALIDITY / UIDNEXT / HIGHESTMODSEQ reported by the last SELECT
+        self.mailbox_state = {}
+        # Extra SEARCH criteria narrowing results to candidate messages (see build_search_filter)
+        self.search_filter = None
+        # UIDNEXT at the last successful search: every lower UID was considered
+        self.searched_uidnext = None
+        self._idle_count = 0
         self.logger = logging.getLogger(__name__)
 
     def connect(self):
         try:
             self.mail = imaplib.IMAP4_SSL(self.server, self.port)
+            self._enable_tcp_keepalive(self.mail.sock)
+            self._search_cache = {}
+            self.searched_uidnext = None
             self.mail.login(self.email, self.password)
-            self.mail.select('inbox')
-            status, messages = self.mail.select('inbox')
-            print(f"Total emails in inbox: {messages[0].decode()}")
+            self.capabilities = self._parse_capabilities(self.mail.capability()[1])
+            # imaplib keeps the pre-login list and checks it in enable(); many
+            # servers (e.g. Gmail) only advertise ENABLE/CONDSTORE after login
+            self.mail.capabilities = tuple(self.capabilities)
+            self._start_compression()
+            self._enable_condstore()
+            status, messages = self.mail.select(self._quote_mailbox(self.folder))
+            if status != 'OK':
+                raise imaplib.IMAP4.error(f"SELECT {self.folder} returned {status}")
+            self.mailbox_state = {
+                'uidvalidity': self._response_int('UIDVALIDITY'),
+                'uidnext': self._response_int('UIDNEXT'),
+                'highestmodseq': self._response_int('HIGHESTMODSEQ')
+            }
+            self.logger.info(f"Total emails in {self.folder} for {self.email}: {messages[0].decode()}")
+            self._last_command = time.monotonic()
             return True
         except Exception as e:
             self.logger.error(f"Connection failed for {self.email}: {str(e)}")
+            self.mail = None
             return False
 
     def disconnect(self):
+        self._log_transfer_stats()
         try:
             if self.mail:
                 self.mail.close()
@@ -32,65 +98,536 @@ class EmailClient:
         except Exception as e:
             self.logger.error(f"Error disconnecting {self.email}: {str(e)}")
 
-    def fetch_emails(self, since_date=None, since_uid=None, batch_size=100, start_index=0):
+    def _uid(self, command, *args):
         """
-        Fetch emails in batches for efficiency.
-        Returns a tuple: (emails, next_start_index)
+        Run a UID command like imaplib's IMAP4.uid(), reconnecting with
+        exponential backoff and re-issuing it if the connection drops. UID
+        commands do not depend on message sequence numbers and FETCH uses PEEK,
+        so a retried command resumes exactly where the failed one stopped.
         """
-        if not self.mail:
-            if not self.connect():
-                return [], None
+        uidvalidity = self.mailbox_state.get('uidvalidity')
+        delay = self.retry_delay
+        for attempt in range(self.max_retries + 1):
+            try:
+                if self.mail is None:
+                    if not self.connect():
+                        raise ConnectionError(f"Reconnect to {self.server} failed")
+                    if self.mailbox_state.get('uidvalidity') != uidvalidity:
+                        # Old UIDs point at different messages now; let the next run resync
+                        raise imaplib.IMAP4.error(f"UIDVALIDITY of {self.folder} changed during the run")
+                if time.monotonic() - self._last_command > self.keepalive_interval:
+                    self.mail.noop()
+                result = self.mail.uid(command, *args)
+                self._last_command = time.monotonic()
+                return result
+            except CONNECTION_ERRORS as e:
+                if attempt == self.max_retries:
+                    raise
+                self.logger.warning(
+                    f"Connection to {self.email} lost ({str(e) or type(e).__name__}), "
+                    f"retrying UID {command.upper()} in {delay:g}s ({attempt + 1}/{self.max_retries})"
+                )
+                self._drop_connection()
+                time.sleep(delay)
+                delay = min(delay * 2, MAX_RETRY_DELAY)
 
+    def _drop_connection(self):
         try:
-            # Search criteria
-            # Update: fetch after last UID, not including it again
-            if since_uid:
-                # since_uid may be str, ensure int
-                try:
-                    next_uid = int(since_uid) + 1
-                except Exception:
-                    next_uid = since_uid  # fallback, but should be int
-                criteria = f'(UID {next_uid}:*)'
+            if self.mail:
+                self.mail.shutdown()
+        except Exception:
+            pass
+        self.mail = None
+
+    @staticmethod
+    def _enable_tcp_keepalive(sock):
+        # Lets the OS notice a silently dead link instead of blocking forever
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+            if hasattr(socket, 'TCP_KEEPIDLE'):
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 60)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 30)
+                sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 4)
+        except OSError:
+            pass
+
+    def wait_for_changes(self, timeout=IDLE_TIMEOUT, poll_interval=60):
+        """
+        Block until the server reports new mail in the selected mailbox or
+        timeout seconds pass. Uses IDLE when advertised and falls back to a NOOP
+        every poll_interval seconds. Returns True if new mail arrived; on a
+        connection error the client is left disconnected and False is returned.
+        """
+        try:
+            if 'IDLE' in self.capabilities:
+                changed = self._idle(timeout)
             else:
-                criteria = "ALL"
+                changed = self._poll(timeout, poll_interval)
+        except Exception as e:
+            self.logger.error(f"Lost connection while waiting for mail for {self.email}: {str(e)}")
+            self.mail = None
+            return False
+
+        if changed:
+            # UIDNEXT/HIGHESTMODSEQ from SELECT are stale now, so the next sync must search
+            self.mailbox_state.pop('uidnext', None)
+            self.mailbox_state.pop('highestmodseq', None)
+            self._search_cache = {}
+        return changed
+
+    def _idle(self, timeout):
+        self._idle_count += 1
+        tag = b'IDLE%d' % self._idle_count
+        self.mail.send(tag + b' IDLE\r\n')
+        line = self.mail.readline()
+        if not line.startswith(b'+'):
+            raise imaplib.IMAP4.error(f"IDLE rejected: {line.strip()!r}")
+
+        changed = False
+        deadline = time.monotonic() + timeout
+        while not changed:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or not self._wait_readable(remaining):
+                break
+            line = self.mail.readline()
+            if not line:
+                raise ConnectionError(f"Connection closed by {self.server}")
+            changed = bool(NEW_MAIL_RE.match(line))
+
+        # Leave IDLE and drain anything the server sent before the tagged reply
+        self.mail.send(b'DONE\r\n')
+        while True:
+            line = self.mail.readline()
+            if not line:
+                raise ConnectionError(f"Connection closed by {self.server}")
+            if line.startswith(tag + b' '):
+                return changed
+            changed = changed or bool(NEW_MAIL_RE.match(line))
+
+    def _wait_readable(self, timeout):
+        # imaplib's reader may already hold lines read along with an earlier
+        # one (e.g. "* 3 EXISTS" right after "+ idling"), and TLS may hold
+        # decrypted bytes; select() on the socket sees neither
+        if self._buffered():
+            return True
+        sock = self.mail.sock
+        if hasattr(sock, 'pending') and sock.pending():
+            return True
+        return bool(select.select([sock], [], [], timeout)[0])
+
+    def _buffered(self):
+        """True if a read from imaplib's reader can return data without blocking."""
+        sock = self.mail.sock
+        timeout = sock.gettimeout()
+        sock.setblocking(False)
+        try:
+            # peek() returns the buffered bytes, or tries one socket read when the buffer is empty
+            return bool(self.mail.file.peek(1))
+        except (BlockingIOError, ssl.SSLWantReadError):
+            return False
+        finally:
+            sock.settimeout(timeout)
+
+    def _poll(self, timeout, poll_interval):
+        self.mail.response('EXISTS')  # discard the count left over from SELECT
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            time.sleep(min(poll_interval, remaining))
+            self.mail.noop()
+            if self.mail.response('EXISTS')[1][-1] is not None:
+                return True
+
+    def _start_compression(self):
+        """Switch the connection to DEFLATE compression (RFC 4978) if enabled and supported."""
+        if not self.compress or 'COMPRESS=DEFLATE' not in self.capabilities:
+            return
+        try:
+            status, _ = self.mail.xatom('COMPRESS', 'DEFLATE')
+        except Exception as e:
+            self.logger.warning(f"Could not enable compression for {self.email}: {str(e)}")
+            return
+        if status != 'OK':
+            return
+        self.mail.sock = DeflateSocket(self.mail.sock)
+        self.mail.file = self.mail.sock.makefile()
+
+    def transfer_stats(self):
+        """Return wire vs. IMAP byte counts for a compressed connection, or None."""
+        sock = self.mail.sock if self.mail else None
+        if not isinstance(sock, DeflateSocket):
+            return None
+        return {
+            'wire_sent': sock.wire_sent, 'data_sent': sock.data_sent,
+            'wire_received': sock.wire_received, 'data_received': sock.data_received
+        }
+
+    def _log_transfer_stats(self):
+        stats = self.transfer_stats()
+        if not stats or not stats['data_received']:
+            return
+        saved = 100 - 100 * stats['wire_received'] // stats['data_received']
+        self.logger.info(
+            f"Received {stats['wire_received'] // 1024} KB on the wire for "
+            f"{stats['data_received'] // 1024} KB of IMAP data from {self.email} ({saved}% saved by compression)"
+        )
+
+    def _enable_condstore(self):
+        """
+        Turn on QRESYNC (which implies CONDSTORE) or CONDSTORE when advertised,
+        so SELECT reports HIGHESTMODSEQ for cheap change detection.
+        """
+        if 'ENABLE' not in self.capabilities:
+            return
+        for extension in ('QRESYNC', 'CONDSTORE'):
+            if extension in self.capabilities:
+                try:
+                    self.mail.enable(extension)
+                except Exception as e:
+                    self.logger.warning(f"Could not enable {extension} for {self.email}: {str(e)}")
+                return
+
+    def _response_int(self, code):
+        _, data = self.mail.response(code)
+        value = data[-1] if data else None
+        if not value:
+            return None
+        try:
+            return int(value.split()[0])
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _quote_mailbox(name):
+        # imaplib sends arguments verbatim, so names like "[Gmail]/All Mail" need quoting
+        return '"' + name.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    @staticmethod
+    def _parse_capabilities(data):
+        if not data or not data[0]:
+            return set()
+        raw = data[0].decode() if isinstance(data[0], bytes) else str(data[0])
+        return set(raw.upper().split())
+
+    def search_uids(self, since_uid=None, since_date=None):
+        """
+        Return the UIDs (ascending, as str) newer than since_uid and, if given,
+        received on or after since_date. The result is cached per connection so
+        repeated batch calls slice one search result instead of re-searching
+        the whole mailbox. Returns None if the search failed, so callers can
+        tell an error apart from "no new mail".
+        """
+        if not self.mail:
+            if not self.connect():
+                return None
 
-            # status, messages = self.mail.search(None, criteria)
-            status, messages = self.mail.uid('search', None, criteria)
+        criteria = self._search_criteria(since_uid, since_date)
+        if criteria in self._search_cache:
+            self.searched_uidnext = self.mailbox_state.get('uidnext')
+            return self._search_cache[criteria]
 
+        try:
+            status, messages = self._uid('search', None, criteria)
             if status != 'OK':
-                return [], None
+                self.logger.error(f"Search failed for {self.email}: {status}")
+                return None
+        except Exception as e:
+            self.logger.error(f"Error searching emails for {self.email}: {str(e)}")
+            return None
 
-            email_ids = messages[0].split()
-            total_emails = len(email_ids)
-            if total_emails == 0 or start_index >= total_emails:
-                return [], None
+        uids = self._uids_from_search(messages, since_uid)
+        self._search_cache[criteria] = uids
+        self.searched_uidnext = self.mailbox_state.get('uidnext')
+        return uids
 
-            # Batch slicing
-            end_index = min(start_index + batch_size, total_emails)
-            batch_ids = email_ids[-end_index: -start_index] if start_index > 0 else email_ids[-end_index:]
-            batch_ids = list(reversed(batch_ids))  # newest first
+    def _search_criteria(self, since_uid, since_date=None):
+        terms = []
+        # Update: fetch after last UID, not including it again
+        if since_uid:
+            # since_uid may be str, ensure int
+            try:
+                next_uid = int(since_uid) + 1
+            except Exception:
+                next_uid = since_uid  # fallback, but should be int
+            terms.append(f'UID {next_uid}:*')
+        if since_date:
+            terms.append(f'SINCE {format_imap_date(since_date)}')
+        if self.search_filter:
+            terms.append(self.search_filter)
+        return f"({' '.join(terms)})" if terms else "ALL"
 
-            emails = []
-            for email_id in batch_ids:
-                # 
-                status, msg_data = self.mail.uid('fetch', email_id, '(RFC822)')
+    @staticmethod
+    def _uids_from_search(messages, since_uid):
+        uids = sorted((uid.decode() for uid in messages[0].split()), key=int)
+        if since_uid:
+            # 'n:*' always matches the newest message, even when it is older than n
+            uids = [uid for uid in uids if int(uid) > int(since_uid)]
+        return uids
 
-                if status != 'OK':
-                    continue
-                raw_email = msg_data[0][1]
-                email_message = email.message_from_bytes(raw_email)
-                emails.append({
-                    'uid': email_id.decode() if isinstance(email_id, bytes) else str(email_id),
-                    'message': email_message,
-                    'raw': raw_email
-                })
-
-            next_start_index = end_index if end_index < total_emails else None
-            return emails, next_start_index
+    def fetch_uid_batch(self, since_uid=None, batch_size=100, start_index=0, since_date=None):
+        """
+        Slice the next batch of UIDs (newest first) out of the cached search result.
+        Returns a tuple: (batch_ids, next_start_index)
+        """
+        uids = self.search_uids(since_uid=since_uid, since_date=since_date) or []
+        return self._slice_batch(uids, batch_size, start_index)
+
+    @staticmethod
+    def _slice_batch(email_ids, batch_size, start_index):
+        total_emails = len(email_ids)
+        if total_emails == 0 or start_index >= total_emails:
+            return [], None
+
+        # Batch slicing
+        end_index = min(start_index + batch_size, total_emails)
+        batch_ids = email_ids[-end_index: -start_index] if start_index > 0 else email_ids[-end_index:]
+        batch_ids = list(reversed(batch_ids))  # newest first
+
+        next_start_index = end_index if end_index < total_emails else None
+        return batch_ids, next_start_index
+
+    def fetch_emails(self, since_date=None, since_uid=None, batch_size=100, start_index=0):
+        """
+        Fetch emails in batches for efficiency.
+        Returns a tuple: (emails, next_start_index)
+        """
+        batch_ids, next_start_index = self.fetch_uid_batch(
+            since_uid=since_uid, since_date=since_date, batch_size=batch_size, start_index=start_index
+        )
+        if not batch_ids:
+            return [], None
+
+        try:
+            return self.fetch_messages(batch_ids), next_start_index
         except Exception as e:
             self.logger.error(f"Error fetching emails for {self.email}: {str(e)}")
             return [], None
 
+    def fetch_headers(self, uids, with_structure=False):
+        """
+        Fetch only From/Subject/Date and RFC822.SIZE for the given UIDs.
+        Returns dicts with a header-only 'message' and the full message 'size'.
+        With with_structure=True the parsed BODYSTRUCTURE is included as 'structure'.
+        """
+        if not uids:
+            return []
+
+        status, msg_data = self._uid('fetch', build_message_set(uids), self._header_items(with_structure))
+        if status != 'OK':
+            self.logger.error(f"Header fetch failed for {self.email}: {status}")
+            return []
+        return self._headers_from_response(uids, msg_data, with_structure)
+
+    def fetch_text_parts(self, headers, max_bytes=None):
+        """
+        Fetch only the text/plain sections located by fetch_headers(with_structure=True)
+        and rebuild a lightweight message from the headers and the decoded text.
+        Attachments are never downloaded, so 'raw' is None for these emails.
+        With max_bytes only the start of each section is fetched (BODY.PEEK[n]<0.max_bytes>)
+        and emails whose text was cut short carry 'body_truncated': True.
+        """
+        sections_by_uid, uids_by_sections = self._plan_text_fetches(headers)
+
+        # One UID FETCH per distinct section layout (most mail shares a handful)
+        bodies = {}
+        for sections, uids in uids_by_sections.items():
+            items = self._text_items(sections, max_bytes)
+            status, msg_data = self._uid('fetch', build_message_set(uids), items)
+            if status != 'OK':
+                self.logger.error(f"Text part fetch failed for {self.email}: {status}")
+                continue
+            bodies.update(self._text_bodies_from_response(msg_data, sections, max_bytes))
+        return self._text_emails(headers, sections_by_uid, bodies)
+
+    def fetch_messages(self, uids, parse=True):
+        """
+        Fetch full messages for the given UIDs with a single UID FETCH.
+        Returns email dicts in the same order as uids. With parse=False only the
+        raw bytes are returned (message=None) so parsing can happen elsewhere.
+        """
+        if not uids:
+            return []
+
+        cached, missing = self._cache_lookup(uids)
+        fetched = []
+        if missing:
+            status, msg_data = self._uid('fetch', build_message_set(missing), MESSAGE_ITEMS)
+            if status != 'OK':
+                self.logger.error(f"Bulk fetch failed for {self.email}: {status}")
+            else:
+                fetched = self._messages_from_response(missing, msg_data, parse)
+                self._cache_store({e['uid']: e['raw'] for e in fetched})
+        return self._merge_cached(uids, cached, fetched, parse)
+
+    def iter_messages(self, since_uid=None, chunk=25, uids=None):
+        """
+        Yield email dicts one at a time (newest first) for the UIDs newer than
+        since_uid, or for an explicit list of uids. Messages are fetched `chunk`
+        at a time and each raw message is released as soon as it is parsed, so
+        peak memory depends on chunk rather than on the caller's batch size.
+        Yielded dicts carry 'uid' and 'message' only.
+        """
+        if uids is None:
+            uids = self.search_uids(since_uid=since_uid) or []
+        queue = UidQueue(uids)
+
+        while queue:
+            chunk_ids = queue.pop_batch(chunk)
+            raws, missing = self._cache_lookup(chunk_ids)
+            if missing:
+                status, msg_data = self._uid('fetch', build_message_set(missing), MESSAGE_ITEMS)
+                if status != 'OK':
+                    self.logger.error(f"Fetch failed for {self.email}: {status}")
+                else:
+                    raws.update(self._raw_messages(msg_data))
+                    del msg_data
+            yield from self._parsed_messages(chunk_ids, raws)
+
+    # Response handling shared with AsyncEmailClient, which only differs in how
+    # commands are sent and responses are read.
+
+    @staticmethod
+    def _header_items(with_structure):
+        items = 'UID RFC822.SIZE'
+        if with_structure:
+            items += ' BODYSTRUCTURE'
+        return f'({items} BODY.PEEK[HEADER.FIELDS ({HEADER_FIELDS})])'
+
+    @staticmethod
+    def _headers_from_response(uids, msg_data, with_structure):
+        records = parse_fetch_response(msg_data)
+        headers = []
+        for email_id in uids:
+            uid = email_id.decode() if isinstance(email_id, bytes) else str(email_id)
+            record = records.get(uid)
+            if not record:
+                continue
+            raw_headers = get_literal(record, 'BODY[HEADER') or b''
+            header = {
+                'uid': uid,
+                'message': email.message_from_bytes(raw_headers),
+                'size': get_size(record)
+            }
+            if with_structure:
+                header['structure'] = get_bodystructure(record)
+            headers.append(header)
+        return headers
+
+    @staticmethod
+    def _plan_text_fetches(headers):
+        sections_by_uid = {}
+        uids_by_sections = {}
+        for header in headers:
+            sections = tuple(find_text_sections(header.get('structure')))
+            sections_by_uid[header['uid']] = sections
+            if sections:
+                uids_by_sections.setdefault(sections, []).append(header['uid'])
+        return sections_by_uid, uids_by_sections
+
+    @staticmethod
+    def _text_items(sections, max_bytes=None):
+        partial = f'<0.{max_bytes}>' if max_bytes else ''
+        return '(UID ' + ' '.join(f'BODY.PEEK[{section}]{partial}' for section, _ in sections) + ')'
+
+    @staticmethod
+    def _text_bodies_from_response(msg_data, sections, max_bytes=None):
+        # uid -> (decoded text, whether any section hit the partial fetch limit)
+        bodies = {}
+        for uid, record in parse_fetch_response(msg_data).items():
+            parts = [get_literal(record, f'BODY[{section}]') or b'' for section, _ in sections]
+            text = b''.join(decode_section(part, encoding) for part, (_, encoding) in zip(parts, sections))
+            bodies[uid] = (text, bool(max_bytes) and any(len(part) >= max_bytes for part in parts))
+        return bodies
+
+    def _text_emails(self, headers, sections_by_uid, bodies):
+        emails = []
+        for header in headers:
+            uid = header['uid']
+            if sections_by_uid[uid] and uid not in bodies:
+                self.logger.warning(f"No text parts returned for UID {uid} in {self.email}, leaving it pending")
+                continue
+            body, truncated = bodies.get(uid, (b'', False))
+            email_data = {
+                'uid': uid,
+                'message': self._build_text_message(header['message'], body),
+                'raw': None
+            }
+            if truncated:
+                email_data['body_truncated'] = True
+            emails.append(email_data)
+        return emails
+
+    @staticmethod
+    def _build_text_message(header_message, body):
+        message = Message()
+        for name, value in header_message.items():
+            message[name] = value
+        message.set_payload(body.decode('utf-8', errors='ignore'), 'utf-8')
+        return message
+
+    def _cache_lookup(self, uids):
+        # (uid -> cached raw bytes, uids still to fetch)
+        if self.cache is None:
+            return {}, list(uids)
+        cached = self.cache.get_many(self.email, self.folder, self.mailbox_state.get('uidvalidity'), uids)
+        if cached:
+            self.logger.info(f"Read {len(cached)}/{len(uids)} messages for {self.email} from the local cache")
+        return cached, [uid for uid in uids if str(uid) not in cached]
+
+    def _cache_store(self, raws):
+        if self.cache is not None and raws:
+            self.cache.put_many(self.email, self.folder, self.mailbox_state.get('uidvalidity'),
+                                {uid: raw for uid, raw in raws.items() if raw is not None})
+
+    @staticmethod
+    def _merge_cached(uids, cached, fetched, parse):
+        if not cached:
+            return fetched
+        by_uid = {e['uid']: e for e in fetched}
+        for uid, raw in cached.items():
+            by_uid[uid] = {'uid': uid, 'message': email.message_from_bytes(raw) if parse else None, 'raw': raw}
+        return [by_uid[str(uid)] for uid in uids if str(uid) in by_uid]
+
+    def _raw_messages(self, msg_data):
+        # uid -> raw message bytes of a FETCH response, added to the cache when enabled
+        raws = {
+            uid: record['literals'][MESSAGE_LITERAL]
+            for uid, record in parse_fetch_response(msg_data).items()
+            if MESSAGE_LITERAL in record['literals']
+        }
+        self._cache_store(raws)
+        return raws
+
+    def _parsed_messages(self, uids, raws):
+        # Parse one message at a time, dropping each raw copy as soon as it is parsed
+        for uid in uids:
+            raw_email = raws.pop(uid, None)
+            if raw_email is None:
+                self.logger.warning(f"No data returned for UID {uid} in {self.email}, leaving it pending")
+                continue
+            email_message = email.message_from_bytes(raw_email)
+            del raw_email
+            yield {'uid': uid, 'message': email_message}
+
+    def _messages_from_response(self, uids, msg_data, parse=True):
+        records = parse_fetch_response(msg_data)
+        emails = []
+        for email_id in uids:
+            uid = email_id.decode() if isinstance(email_id, bytes) else str(email_id)
+            record = records.get(uid)
+            if not record or MESSAGE_LITERAL not in record['literals']:
+                self.logger.warning(f"No data returned for UID {uid} in {self.email}, leaving it pending")
+                continue
+            raw_email = record['literals'][MESSAGE_LITERAL]
+            emails.append({
+                'uid': uid,
+                'message': email.message_from_bytes(raw_email) if parse else None,
+                'raw': raw_email
+            })
+        return emails
+
     @staticmethod
     def clean_text(text):
         if text is None:
@@ -4,99 +4,163 @@ from email.utils import parseaddr
 from urllib.parse import urlparse
 import yaml
 import os
+import threading
+from collections import Counter
 from email_client import EmailClient
+from ruleset import RuleSet
+from verdict_cache import DomainVerdictCache
 import phonenumbers
 
+COMPANY_PATTERNS = [
+    re.compile(r'at\s+([A-Z][a-zA-Z\s&]+)'),
+    re.compile(r'([A-Z][a-zA-Z\s&]+)\s*Inc'),
+    re.compile(r'([A-Z][a-zA-Z\s&]+)\s*LLC'),
+]
+URL_PATTERN = re.compile(r'https?://[^\s/$.?#].[^\s]*')
+LINKEDIN_PATTERN = re.compile(r'https?://(?:[a-z]{2,3}\.)?linkedin\.com/in/([a-zA-Z0-9\-_]+)')
+LINKEDIN_ID_PATTERN = re.compile(r'linkedin\.com/in/([a-zA-Z0-9\-_]+)')
+
 class ContactExtractor:
-    def __init__(self):
+    def __init__(self, rules_path=None, verdict_cache_path=None):
         self.logger = logging.getLogger(__name__)
-        self.rules = self._load_rules()
+        self.rules = self._load_rules(rules_path)
+        self.domain_verdicts = DomainVerdictCache(path=verdict_cache_path)
+        # Emails decided by each stage of is_recruiter_email
+        self.stage_counts = Counter()
+        self._stage_lock = threading.Lock()
 
-    def _load_rules(self):
+    def _load_rules(self, rules_path=None):
         try:
-            base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-            rules_path = os.path.join(base_dir, 'config', 'rules.yaml')
+            if rules_path is None:
+                base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+                rules_path = os.path.join(base_dir, 'config', 'rules.yaml')
             with open(rules_path, 'r') as file:
-                rules = yaml.safe_load(file)
+                rules = RuleSet(yaml.safe_load(file))
                 self.logger.info(f"Loaded rules: {rules.keys()}")
                 return rules
         except Exception as e:
             self.logger.error(f"Error loading rules: {str(e)}")
-            return {}
+            return RuleSet()
 
     def is_recruiter_email(self, email_message):
-        subject = self._get_email_subject(email_message)
-        from_email = self._get_sender_email(email_message)
-        sender_name = parseaddr(email_message.get('From', ''))[0]
-        body = self._get_email_body(email_message)
+        """
+        Classify an email in stages, cheapest first, stopping at the first one
+        that decides it: sender blacklist, sender domain, then recruiter
+        keywords in the sender address, sender name, subject and, only if still
+        undecided, the body. The deciding stage is counted in stage_counts.
+        """
+        is_recruiter, stage = self._classify(email_message)
+        with self._stage_lock:
+            self.stage_counts[stage] += 1
+        return is_recruiter
 
-        # Defensive: always use a list
-        recruiter_keywords = self.rules.get('recruiter_keywords') or []
-        if not recruiter_keywords:
+    def _classify(self, email_message):
+        keywords = self.rules.keyword_matcher
+        if not keywords:
             self.logger.error("No recruiter_keywords found in rules. Please check rules.yaml.")
-            return False
+            return False, 'no_rules'
 
-        subject_match = any(keyword.lower() in subject.lower() for keyword in recruiter_keywords)
-        name_match = any(keyword.lower() in sender_name.lower() for keyword in recruiter_keywords)
-        email_match = any(keyword.lower() in from_email.lower() for keyword in recruiter_keywords)
-        body_match = any(keyword.lower() in body.lower() for keyword in recruiter_keywords)
+        # Exclude generic job board/system emails
+        from_email = self._get_sender_email(email_message)
+        if self._is_generic_sender(from_email):
+            return False, 'generic_sender'
 
         # Check sender domain against domain strategy
         domain = from_email.split('@')[-1].lower() if '@' in from_email else ''
-        domain_valid = self._validate_domain(domain)
-
-        # Exclude generic job board/system emails
-        # Use always_blacklist patterns from rules.yaml for generic sender exclusion
-        generic_patterns = self.rules.get('always_blacklist', [])
-        for pattern in generic_patterns:
-            if re.fullmatch(pattern, from_email):
-                self.logger.info(f"Skipping generic sender: {from_email} (pattern: {pattern})")
-                return False
-
-        if not (subject_match or name_match or email_match or body_match):
-            self.logger.info(f"Email from {from_email} skipped: no recruiter keywords in subject, sender name, sender email, or body.")
-        if not domain_valid:
+        if not self._validate_domain(domain):
             self.logger.info(f"Email from {from_email} skipped: domain '{domain}' not valid per rules.")
+            return False, 'invalid_domain'
+
+        if keywords.search(from_email):
+            return True, 'sender_email'
+        if keywords.search(parseaddr(email_message.get('From', ''))[0].lower()):
+            return True, 'sender_name'
+        if keywords.search(self._get_email_subject(email_message).lower()):
+            return True, 'subject'
+        if keywords.search(self._get_email_body(email_message).lower()):
+            return True, 'body'
+
+        self.logger.info(f"Email from {from_email} skipped: no recruiter keywords in subject, sender name, sender email, or body.")
+        return False, 'no_keywords'
+
+    def log_stage_counts(self):
+        """Log how many emails each classification stage decided."""
+        with self._stage_lock:
+            counts = ', '.join(f"{stage}: {count}" for stage, count in self.stage_counts.most_common())
+        if counts:
+            self.logger.info(f"Emails decided per classification stage - {counts}")
+
+    def keyword_hits(self, email_message):
+        """
+        Which recruiter_keywords occur in each field checked by
+        is_recruiter_email, e.g. {'subject': ['job'], 'sender_name': [],
+        'sender_email': [], 'body': ['job', 'role']}. For explaining verdicts.
+        """
+        keywords = self.rules.keyword_matcher
+        return {
+            'subject': keywords.hits(self._get_email_subject(email_message).lower()),
+            'sender_name': keywords.hits(parseaddr(email_message.get('From', ''))[0].lower()),
+            'sender_email': keywords.hits(self._get_sender_email(email_message)),
+            'body': keywords.hits(self._get_email_body(email_message).lower()),
+        }
 
-        return (subject_match or name_match or email_match or body_match) and domain_valid
+    def is_candidate_sender(self, email_message):
+        """
+        Header-only pre-check used before downloading a body: rejects generic
+        senders and invalid domains. Keyword checks need the body, so they are
+        left to is_recruiter_email.
+        """
+        from_email = self._get_sender_email(email_message)
+        if self._is_generic_sender(from_email):
+            return False
+
+        domain = from_email.split('@')[-1].lower() if '@' in from_email else ''
+        if not self._validate_domain(domain):
+            self.logger.info(f"Email from {from_email} skipped on headers: domain '{domain}' not valid per rules.")
+            return False
+        return True
+
+    def _is_generic_sender(self, from_email):
+        # Use always_blacklist patterns from rules.yaml for generic sender exclusion
+        pattern = self.rules.always_blacklist.first_match(from_email)
+        if pattern is not None:
+            self.logger.info(f"Skipping generic sender: {from_email} (pattern: {pattern})")
+            return True
+        return False
 
     def _validate_domain(self, domain):
         if not domain:
             return False
 
-        strategy = self.rules.get('domain_strategy', 'hybrid')
+        verdict = self.domain_verdicts.get(self.rules.digest, domain)
+        if verdict is None:
+            verdict = self._match_domain(domain)
+            self.domain_verdicts.put(self.rules.digest, domain, verdict)
+        return verdict
+
+    def save_domain_verdicts(self):
+        """Persist cached domain verdicts for the next run (only if a cache path was given)."""
+        self.domain_verdicts.save(self.rules.digest)
+
+    def _match_domain(self, domain):
+        rules = self.rules
+        strategy = rules.domain_strategy
 
         # Check always_blacklist first
-        for pattern in self.rules.get('always_blacklist') or []:
-            if re.fullmatch(pattern, domain):
-                return False
+        if rules.always_blacklist.fullmatch(domain):
+            return False
 
         # Check always_whitelist
-        for pattern in self.rules.get('always_whitelist') or []:
-            if re.fullmatch(pattern, domain):
-                return True
+        if rules.always_whitelist.fullmatch(domain):
+            return True
 
         # Apply selected strategy
         if strategy == 'whitelist':
-            return any(
-                re.fullmatch(pattern, domain)
-                for pattern in self.rules.get('whitelist_domains') or []
-            )
+            return rules.whitelist_domains.fullmatch(domain)
         elif strategy == 'blacklist':
-            return not any(
-                re.fullmatch(pattern, domain)
-                for pattern in self.rules.get('blacklist_patterns') or []
-            )
+            return not rules.blacklist_patterns.fullmatch(domain)
         else:  # hybrid - must be in whitelist AND not in blacklist
-            whitelisted = any(
-                re.fullmatch(pattern, domain)
-                for pattern in self.rules.get('whitelist_domains') or []
-            )
-            blacklisted = any(
-                re.fullmatch(pattern, domain)
-                for pattern in self.rules.get('blacklist_patterns') or []
-            )
-            return whitelisted and not blacklisted
+            return rules.whitelist_domains.fullmatch(domain) and not rules.blacklist_patterns.fullmatch(domain)
 
     def extract_contacts(self, email_message, source_email=None):
         from_header = email_message.get('From', '')
@@ -143,8 +207,8 @@ class ContactExtractor:
         return body
 
     def _extract_phone(self, text):
-        for pattern in self.rules.get('signature_patterns', {}).get('phone') or []:
-            for match in re.finditer(pattern, text):
+        for pattern in self.rules.phone_patterns:
+            for match in pattern.finditer(text):
                 phone = match.group(0)
                 # Try to parse and format the phone number
                 try:
@@ -159,14 +223,8 @@ class ContactExtractor:
 
     def _extract_company(self, text, sender_email):
         # First try to find company name in signature
-        company_patterns = [
-            r'at\s+([A-Z][a-zA-Z\s&]+)',
-            r'([A-Z][a-zA-Z\s&]+)\s*Inc',
-            r'([A-Z][a-zA-Z\s&]+)\s*LLC',
-        ]
-        
-        for pattern in company_patterns:
-            match = re.search(pattern, text)
+        for pattern in COMPANY_PATTERNS:
+            match = pattern.search(text)
             if match:
                 return match.group(1).strip()
         
@@ -178,8 +236,7 @@ class ContactExtractor:
         return None
 
     def _extract_website(self, text):
-        url_pattern = r'https?://[^\s/$.?#].[^\s]*'
-        matches = re.findall(url_pattern, text)
+        matches = URL_PATTERN.findall(text)
         for url in matches:
             parsed = urlparse(url)
             if parsed.netloc and 'linkedin.com' not in parsed.netloc:
@@ -188,16 +245,15 @@ class ContactExtractor:
 
     def _extract_linkedin(self, text):
         # Look for LinkedIn URLs in the text
-        linkedin_pattern = r'https?://(?:[a-z]{2,3}\.)?linkedin\.com/in/([a-zA-Z0-9\-_]+)'
-        match = re.search(linkedin_pattern, text)
+        match = LINKEDIN_PATTERN.search(text)
         if match:
             return match.group(1)  # This is the LinkedIn ID
         # Fallback to previous patterns if needed
-        for pattern in self.rules.get('signature_patterns', {}).get('linkedin', []):
-            match = re.search(pattern, text)
+        for pattern in self.rules.linkedin_patterns:
+            match = pattern.search(text)
             if match:
                 # Try to extract the ID from the matched URL
-                id_match = re.search(r'linkedin\.com/in/([a-zA-Z0-9\-_]+)', match.group(0))
+                id_match = LINKEDIN_ID_PATTERN.search(match.group(0))
                 if id_match:
                     return id_match.group(1)
         return None
\ No newline at end of file
@@ -0,0 +1,455 @@
+import base64
+import io
+import quopri
+import re
+import zlib
+
+FETCH_START_RE = re.compile(rb'^\s*(\d+) \(')
+LITERAL_ITEM_RE = re.compile(
+    rb'((?:BODY|BINARY)\[[^\]]*\](?:<\d+>)?|RFC822(?:\.HEADER|\.TEXT)?)\s*\{\d+\}$',
+    re.IGNORECASE
+)
+LITERAL_MARKER_RE = re.compile(rb'\{\d+\}$')
+QUOTED_RE = re.compile(rb'"(?:[^"\\]|\\.)*"')
+ATOM_RE = re.compile(rb'[^\s()\[\]"]+')
+SIZE_RE = re.compile(rb'\bRFC822\.SIZE (\d+)', re.IGNORECASE)
+BODYSTRUCTURE_RE = re.compile(rb'\bBODYSTRUCTURE \(', re.IGNORECASE)
+TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|([^\s()"]+))')
+
+MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec']
+
+
+def _uid_to_int(uid):
+    if isinstance(uid, bytes):
+        uid = uid.decode()
+    return int(uid)
+
+
+def build_message_set(uids):
+    """
+    Compress a list of UIDs into an IMAP message set, e.g. [5, 7, 9, 10, 11] -> '5,7,9:11'.
+    """
+    numbers = sorted({_uid_to_int(uid) for uid in uids})
+    if not numbers:
+        return ''
+
+    ranges = []
+    start = prev = numbers[0]
+    for number in numbers[1:]:
+        if number == prev + 1:
+            prev = number
+            continue
+        ranges.append(f"{start}:{prev}" if start != prev else str(start))
+        start = prev = number
+    ranges.append(f"{start}:{prev}" if start != prev else str(start))
+    return ','.join(ranges)
+
+
+class UidQueue:
+    """
+    Ascending list of UIDs consumed newest-first in batches. Keeps the remaining
+    UIDs as ranges so the message set for a checkpoint costs O(ranges) rather
+    than re-sorting the whole list after every batch.
+    """
+
+    def __init__(self, uids):
+        self.uids = sorted((str(uid) for uid in uids), key=int)
+        self._ranges = []
+        for uid in map(int, self.uids):
+            if self._ranges and self._ranges[-1][1] == uid - 1:
+                self._ranges[-1][1] = uid
+            else:
+                self._ranges.append([uid, uid])
+
+    def __len__(self):
+        return len(self.uids)
+
+    def peek_batch(self, size):
+        """Return the newest `size` UIDs, newest first, without removing them."""
+        return list(reversed(self.uids[-size:]))
+
+    def pop_batch(self, size):
+        """Remove and return the newest `size` UIDs, newest first."""
+        batch = self.peek_batch(size)
+        del self.uids[-len(batch):]
+        remaining = len(batch)
+        while remaining:
+            start, end = self._ranges[-1]
+            span = end - start + 1
+            if span <= remaining:
+                self._ranges.pop()
+                remaining -= span
+            else:
+                self._ranges[-1][1] = end - remaining
+                remaining = 0
+        return batch
+
+    def split(self, parts):
+        """Partition into up to `parts` contiguous UID ranges (oldest range first)."""
+        size = -(-len(self.uids) // max(parts, 1)) or 1
+        return [UidQueue(self.uids[i:i + size]) for i in range(0, len(self.uids), size)]
+
+    def message_set(self):
+        return ','.join(f"{start}:{end}" if start != end else str(start) for start, end in self._ranges)
+
+
+def expand_message_set(message_set):
+    """Expand a message set built by build_message_set back into a sorted list of UIDs (str)."""
+    uids = []
+    for part in (message_set or '').split(','):
+        if not part:
+            continue
+        start, _, end = part.partition(':')
+        uids.extend(str(uid) for uid in range(int(start), int(end or start) + 1))
+    return uids
+
+
+def format_imap_date(value):
+    """Format a date as an IMAP SEARCH date (e.g. 05-Mar-2024), independent of locale."""
+    return f"{value.day:02d}-{MONTHS[value.month - 1]}-{value.year}"
+
+
+def build_search_filter(rules):
+    """
+    Translate recruiter rules into IMAP SEARCH criteria that let the server
+    return only candidate messages. Standard SEARCH keys match substrings, and
+    every term is looser than the client-side check it stands for, so the
+    server never drops a message the local rules would accept (UIDs it leaves
+    out are skipped for good by the checkpoint):
+    - any recruiter keyword in SUBJECT, FROM or BODY;
+    - FROM one of the whitelisted domains, unless a pattern is not a plain
+      domain or '.*'-prefixed suffix (then no domain restriction is added).
+    Blacklists are left to the client: a substring such as NOT FROM
+    "@indeed.com" would also drop x@indeed.com.au, which fullmatch accepts.
+    Returns None when the rules cannot be expressed (e.g. non-ASCII keywords).
+    """
+    keywords = [str(k) for k in rules.get('recruiter_keywords') or []]
+    if not keywords or not all(k.isascii() for k in keywords):
+        return None
+
+    allowed = None
+    if rules.get('domain_strategy', 'hybrid') in ('whitelist', 'hybrid'):
+        patterns = (rules.get('whitelist_domains') or []) + (rules.get('always_whitelist') or [])
+        allowed = [_domain_substring(pattern) for pattern in patterns]
+        if not allowed or None in allowed:
+            allowed = None
+
+    terms = [_or_terms([
+        f'{key} {_quote_string(keyword)}' for keyword in keywords for key in ('SUBJECT', 'FROM', 'BODY')
+    ])]
+    if allowed:
+        terms.append(_or_terms([f'FROM {_quote_string(a)}' for a in allowed]))
+    return ' '.join(terms)
+
+
+def _regex_literal(pattern):
+    # The text a regex matches if it has no metacharacters besides escapes, else None
+    if re.search(r'(?<!\\)[.*+?^$()\[\]{}|]', pattern) or re.search(r'\\[A-Za-z0-9]', pattern):
+        return None
+    return re.sub(r'\\(.)', r'\1', pattern)
+
+
+def _domain_substring(pattern):
+    # Text contained in every address whose domain fullmatches the pattern
+    if pattern.startswith('.*'):
+        literal = _regex_literal(pattern[2:])
+        return literal or None
+    literal = _regex_literal(pattern)
+    return f'@{literal}' if literal and '@' not in literal else None
+
+
+def _or_terms(terms):
+    # IMAP OR takes exactly two keys, so nest them: OR a OR b c
+    if len(terms) == 1:
+        return terms[0]
+    return f'OR {terms[0]} {_or_terms(terms[1:])}'
+
+
+def _quote_string(value):
+    return '"' + value.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+
+def _quote(literal):
+    escaped = literal.replace(b'\\', b'\\\\').replace(b'"', b'\\"')
+    return b'"' + escaped.replace(b'\r', b' ').replace(b'\n', b' ') + b'"'
+
+
+def parse_fetch_response(data):
+    """
+    Demultiplex an imaplib FETCH response into one record per message.
+
+    imaplib returns a flat list mixing (header, literal) tuples and plain bytes
+    for every message in the response. Returns a dict keyed by UID (str) with
+    'text' (the non-literal part of the response, literals replaced by NIL) and
+    'literals' (section name -> bytes, e.g. 'BODY[]' or 'BODY[1]').
+    """
+    parts = []
+    current = None
+    for item in data or []:
+        if isinstance(item, tuple):
+            head, literal = item[0], item[1]
+        elif isinstance(item, bytes):
+            head, literal = item, None
+        else:
+            continue
+
+        if FETCH_START_RE.match(head):
+            current = {'text': b'', 'literals': {}}
+            parts.append(current)
+        if current is None:
+            continue
+
+        if literal is None:
+            current['text'] += head
+            continue
+
+        match = LITERAL_ITEM_RE.search(head)
+        if match:
+            key = match.group(1).decode('ascii', errors='ignore').upper()
+            current['literals'][key] = literal
+            current['text'] += head[:match.start()] + match.group(1) + b' NIL'
+        else:
+            # Literal nested inside a structure (e.g. an odd filename in BODYSTRUCTURE)
+            current['text'] += LITERAL_MARKER_RE.sub(b'', head) + _quote(literal)
+
+    records = {}
+    for part in parts:
+        uid = _fetch_uid(part['text'])
+        if uid is None:
+            # Unsolicited FETCH (e.g. flag updates) without a UID
+            continue
+        record = records.get(uid)
+        if record is None:
+            records[uid] = {
+                'uid': uid,
+                'text': part['text'],
+                'literals': part['literals']
+            }
+            continue
+        # A second FETCH for the same message, e.g. the FLAGS/MODSEQ update that
+        # CONDSTORE servers send alongside the data: add to the first, never replace it
+        record['text'] += b' ' + part['text']
+        for key, literal in part['literals'].items():
+            record['literals'].setdefault(key, literal)
+    return records
+
+
+def _fetch_uid(text):
+    """The UID item of one FETCH response, ignoring 'UID n' inside nested lists and strings."""
+    match = FETCH_START_RE.match(text)
+    if not match:
+        return None
+    pos = match.end()
+    depth = 0
+    previous = None
+    while pos < len(text):
+        char = text[pos:pos + 1]
+        if char == b'"':
+            end = QUOTED_RE.match(text, pos)
+            pos = end.end() if end else len(text)
+            previous = None
+        elif char in b'([':
+            depth += 1
+            pos += 1
+        elif char in b')]':
+            if depth == 0:
+                return None
+            depth -= 1
+            pos += 1
+        elif char.isspace():
+            pos += 1
+        else:
+            atom = ATOM_RE.match(text, pos).group(0)
+            pos += len(atom)
+            if depth == 0:
+                if previous == b'UID' and atom.isdigit():
+                    return atom.decode()
+                previous = atom.upper()
+    return None
+
+
+def get_literal(record, prefix):
+    """Return the first literal whose section name starts with prefix (e.g. 'BODY[HEADER')."""
+    prefix = prefix.upper()
+    for key, value in record.get('literals', {}).items():
+        if key.startswith(prefix):
+            return value
+    return None
+
+
+def get_size(record):
+    """Return RFC822.SIZE from a parsed FETCH record, or None if it was not requested."""
+    match = SIZE_RE.search(record.get('text', b''))
+    return int(match.group(1)) if match else None
+
+
+def parse_imap_list(text, pos=0):
+    """
+    Parse one parenthesized IMAP list starting at text[pos] into nested Python
+    lists of str/None. Returns (parsed, end_pos).
+    """
+    stack = []
+    current = None
+    while pos < len(text):
+        match = TOKEN_RE.match(text, pos)
+        if not match:
+            break
+        pos = match.end()
+        open_paren, close_paren, quoted, atom = match.groups()
+        if open_paren:
+            new_list = []
+            if current is not None:
+                current.append(new_list)
+                stack.append(current)
+            current = new_list
+        elif close_paren:
+            if not stack:
+                return current, pos
+            current = stack.pop()
+        elif quoted is not None:
+            value = re.sub(rb'\\(.)', rb'\1', quoted).decode('utf-8', errors='ignore')
+            current.append(value)
+        else:
+            value = atom.decode('utf-8', errors='ignore')
+            current.append(None if value.upper() == 'NIL' else value)
+    return current, pos
+
+
+def get_bodystructure(record):
+    """Return the parsed BODYSTRUCTURE of a FETCH record, or None if it was not requested."""
+    match = BODYSTRUCTURE_RE.search(record.get('text', b''))
+    if not match:
+        return None
+    structure, _ = parse_imap_list(record['text'], match.end() - 1)
+    return structure
+
+
+def find_text_sections(structure):
+    """
+    Return (section, transfer_encoding) for every text/plain part of a
+    BODYSTRUCTURE, mirroring what ContactExtractor._get_email_body reads.
+    A single-part message always yields its whole body as section '1'.
+    """
+    if not structure:
+        return []
+    if not isinstance(structure[0], list):
+        return [('1', _part_encoding(structure))]
+    return _walk_text_sections(structure, '')
+
+
+def _walk_text_sections(structure, prefix):
+    sections = []
+    if isinstance(structure[0], list):
+        children = [part for part in structure if isinstance(part, list)]
+        for index, child in enumerate(children, 1):
+            sections.extend(_walk_text_sections(child, f"{prefix}.{index}" if prefix else str(index)))
+        return sections
+
+    section = prefix or '1'
+    content_type = f"{structure[0] or ''}/{structure[1] or ''}".lower()
+    if content_type == 'text/plain':
+        sections.append((section, _part_encoding(structure)))
+    elif content_type == 'message/rfc822' and len(structure) > 8 and isinstance(structure[8], list):
+        # Encapsulated message: its parts are numbered below this section
+        nested = structure[8]
+        if isinstance(nested[0], list):
+            sections.extend(_walk_text_sections(nested, section))
+        elif f"{nested[0] or ''}/{nested[1] or ''}".lower() == 'text/plain':
+            sections.append((f"{section}.1", _part_encoding(nested)))
+    return sections
+
+
+def _part_encoding(part):
+    return (part[5] or '7bit').lower() if len(part) > 5 else '7bit'
+
+
+def decode_section(data, encoding):
+    """Undo the Content-Transfer-Encoding of a fetched body section."""
+    if not data:
+        return b''
+    encoding = (encoding or '').lower()
+    try:
+        if encoding == 'base64':
+            # A partial fetch may end mid-quantum; decode the complete ones
+            data = re.sub(rb'\s+', b'', data)
+            return base64.b64decode(data[:len(data) // 4 * 4])
+        if encoding == 'quoted-printable':
+            return quopri.decodestring(data)
+    except Exception:
+        return data
+    return data
+
+
+class DeflateSocket:
+    """
+    Socket wrapper for an IMAP connection after COMPRESS=DEFLATE (RFC 4978):
+    writes are raw-DEFLATE compressed and reads inflated. Counts bytes on the
+    wire and the IMAP data they carry in each direction.
+    """
+
+    def __init__(self, sock):
+        self.sock = sock
+        self._deflate = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED, -15)
+        self._inflate = zlib.decompressobj(-15)
+        self._buffer = b''
+        self._offset = 0
+        self.wire_sent = self.data_sent = 0
+        self.wire_received = self.data_received = 0
+
+    def sendall(self, data):
+        self.data_sent += len(data)
+        compressed = self._deflate.compress(data) + self._deflate.flush(zlib.Z_SYNC_FLUSH)
+        self.wire_sent += len(compressed)
+        self.sock.sendall(compressed)
+
+    def recv_into(self, buffer):
+        while self._offset >= len(self._buffer):
+            chunk = self.sock.recv(65536)
+            if not chunk:
+                return 0
+            self.wire_received += len(chunk)
+            self._buffer = self._inflate.decompress(chunk)
+            self._offset = 0
+            self.data_received += len(self._buffer)
+        count = min(len(buffer), len(self._buffer) - self._offset)
+        buffer[:count] = self._buffer[self._offset:self._offset + count]
+        self._offset += count
+        return count
+
+    def makefile(self):
+        return io.BufferedReader(_DeflateReader(self))
+
+    def pending(self):
+        inner = self.sock.pending() if hasattr(self.sock, 'pending') else 0
+        return len(self._buffer) - self._offset + inner
+
+    def fileno(self):
+        return self.sock.fileno()
+
+    def gettimeout(self):
+        return self.sock.gettimeout()
+
+    def settimeout(self, timeout):
+        self.sock.settimeout(timeout)
+
+    def setblocking(self, flag):
+        self.sock.setblocking(flag)
+
+    def shutdown(self, how):
+        self.sock.shutdown(how)
+
+    def close(self):
+        self.sock.close()
+
+
+class _DeflateReader(io.RawIOBase):
+    # Closing the reader must not close the socket; imaplib closes both separately
+
+    def __init__(self, deflate_socket):
+        self.deflate_socket = deflate_socket
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        return self.deflate_socket.recv_into(buffer)
@@ -0,0 +1,308 @@
+import email
+import json
+import logging
+import mmap
+import os
+import time
+import zlib
+from email.utils import parsedate_to_datetime
+from email_client import EmailClient
+from imap_utils import UidQueue
+
+SOURCE_TYPES = ('mbox', 'maildir', 'eml')
+MBOX_SEPARATOR = b'\nFrom '
+# Bytes of the first mbox message that go into its UIDVALIDITY
+MBOX_IDENTITY_BYTES = 64 * 1024
+
+
+class LocalMailSource:
+    """
+    Reads messages from an mbox file, a Maildir or a directory of .eml files
+    and exposes them through the same methods EmailClient offers, so the
+    normal batch, pipeline and checkpoint code can backfill from exports.
+
+    mbox messages are numbered 1..n in file order and those numbers act as
+    UIDs; the file is memory mapped and only the message boundaries are
+    indexed, so a multi-GB export is never loaded whole. Appending keeps the
+    numbering, and a file replaced by a new export gets a new UIDVALIDITY
+    (see _mbox_uidvalidity). Maildir and .eml
+    files get UIDs from a UID list kept in data/local_uids (like Dovecot's
+    dovecot-uidlist): a file keeps its UID for good and new files always get
+    higher ones, so deleting or inserting files never shifts other UIDs.
+
+    accounts.yaml: email (label for checkpoints and the CSV 'source' column),
+    source (mbox, maildir or eml) and path.
+    """
+
+    def __init__(self, email_account):
+        self.email = email_account['email']
+        self.source_type = email_account['source']
+        self.path = os.path.expanduser(email_account['path'])
+        self.folder = email_account.get('folder', 'INBOX')
+        self.capabilities = set()
+        self.mailbox_state = {}
+        self.search_filter = None
+        self.searched_uidnext = None
+        # Local reads cost nothing per byte, so size capping is never needed
+        self.max_message_size = None
+        self.partial_size = 0
+        # Set while the source is open, mirroring EmailClient.mail
+        self.mail = None
+        self._file = None
+        self._mmap = None
+        self._offsets = []
+        # uid (int) -> file path, for Maildir and .eml sources
+        self._paths = {}
+        self._uidlist = None
+        self.logger = logging.getLogger(__name__)
+
+    def connect(self):
+        try:
+            if self.source_type == 'mbox':
+                self._open_mbox()
+                uidvalidity = self._mbox_uidvalidity()
+                uidnext = self._count() + 1
+            else:
+                files = self._maildir_files() if self.source_type == 'maildir' else self._eml_files()
+                uidvalidity, uidnext = self._assign_uids(files)
+            count = self._count()
+            self.mail = self.path
+            self.mailbox_state = {
+                'uidvalidity': uidvalidity,
+                'uidnext': uidnext,
+                'highestmodseq': None
+            }
+            self._signature = self._stat_signature()
+            self.logger.info(f"Found {count} messages in {self.source_type} source {self.path}")
+            return True
+        except Exception as e:
+            self.logger.error(f"Could not open {self.source_type} source {self.path}: {str(e)}")
+            self.mail = None
+            return False
+
+    def disconnect(self):
+        try:
+            if self._mmap is not None:
+                self._mmap.close()
+            if self._file is not None:
+                self._file.close()
+        except Exception as e:
+            self.logger.error(f"Error closing {self.path}: {str(e)}")
+        finally:
+            self.mail = None
+            self._file = None
+            self._mmap = None
+
+    def _open_mbox(self):
+        self._file = open(self.path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        if size == 0:
+            self._offsets = []
+            return
+        mm = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        # Each message starts at a "From " line; find() scans the mapping at disk speed
+        offsets = [0] if mm[:5] == b'From ' else []
+        position = mm.find(MBOX_SEPARATOR)
+        while position != -1:
+            offsets.append(position + 1)
+            position = mm.find(MBOX_SEPARATOR, position + 1)
+        offsets.append(size)
+        self._mmap = mm
+        self._offsets = offsets
+
+    def _mbox_uidvalidity(self):
+        """
+        Derived from the path, the inode and the start of the first message:
+        unchanged while mail is appended, different once the file is rewritten
+        (a new Takeout export saved over the old one, a compacted folder), so
+        checkpoints made against the old message numbers trigger a resync.
+        """
+        identity = f"{os.path.abspath(self.path)}:{os.fstat(self._file.fileno()).st_ino}".encode()
+        first_message = b''
+        if self._count():
+            first_message = self._mmap[self._offsets[0]:min(self._offsets[1], self._offsets[0] + MBOX_IDENTITY_BYTES)]
+        return zlib.crc32(first_message, zlib.crc32(identity)) or 1
+
+    def _maildir_files(self):
+        """{unique name: path}; flags after ':' change when mail moves to cur/, the name before it does not."""
+        files = {}
+        for subdir in ('new', 'cur'):
+            directory = os.path.join(self.path, subdir)
+            if os.path.isdir(directory):
+                for name in os.listdir(directory):
+                    if not name.startswith('.'):
+                        files[name.split(':')[0]] = os.path.join(directory, name)
+        return files
+
+    def _eml_files(self):
+        """{path relative to the source directory: path}"""
+        files = {}
+        for root, _, names in os.walk(self.path):
+            for name in names:
+                if name.lower().endswith('.eml'):
+                    path = os.path.join(root, name)
+                    files[os.path.relpath(path, self.path)] = path
+        return files
+
+    def _uidlist_path(self):
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        key = zlib.crc32(f"{self.source_type}:{os.path.abspath(self.path)}".encode())
+        return os.path.join(base_dir, 'data', 'local_uids', f"{key:08x}.json")
+
+    def _assign_uids(self, files):
+        """
+        Map the current files to UIDs through the saved UID list, giving new
+        files (in name order, which is delivery order for Maildir) the next
+        free UIDs. Returns (uidvalidity, uidnext). A missing or unreadable
+        UID list starts a new UIDVALIDITY, so checkpoints made against the old
+        numbering trigger a resync instead of skipping mail.
+        """
+        path = self._uidlist_path()
+        try:
+            with open(path, 'r') as f:
+                uidlist = json.load(f)
+            uids = {name: int(uid) for name, uid in uidlist['uids'].items()}
+            uidvalidity, uidnext = int(uidlist['uidvalidity']), int(uidlist['uidnext'])
+        except FileNotFoundError:
+            uids, uidvalidity, uidnext = {}, int(time.time()), 1
+        except Exception as e:
+            self.logger.warning(f"Unreadable UID list {path} ({str(e)}), renumbering {self.path}")
+            uids, uidvalidity, uidnext = {}, int(time.time()), 1
+
+        # Forget deleted files; their UIDs are never reused
+        uids = {name: uid for name, uid in uids.items() if name in files}
+        for name in sorted(files.keys() - uids.keys()):
+            uids[name] = uidnext
+            uidnext += 1
+        self._paths = {uid: files[name] for name, uid in uids.items()}
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump({'path': os.path.abspath(self.path), 'uidvalidity': uidvalidity,
+                       'uidnext': uidnext, 'uids': uids}, f)
+        os.replace(tmp_path, path)
+        return uidvalidity, uidnext
+
+    def _count(self):
+        return max(len(self._offsets) - 1, 0) if self.source_type == 'mbox' else len(self._paths)
+
+    def _uids(self):
+        """All UIDs in ascending order."""
+        if self.source_type == 'mbox':
+            return range(1, self._count() + 1)
+        return sorted(self._paths)
+
+    def _read(self, uid, headers_only=False):
+        if self.source_type != 'mbox':
+            path = self._paths.get(int(uid))
+            if path is None:
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        index = int(uid) - 1
+        if index < 0 or index >= self._count():
+            return None
+        start, end = self._offsets[index], self._offsets[index + 1]
+        # Drop the "From " separator line; it is not part of the message
+        line_end = self._mmap.find(b'\n', start, end)
+        start = line_end + 1 if line_end != -1 else end
+        if headers_only:
+            # Copy just the header block out of the mapping
+            header_end = self._mmap.find(b'\n\n', start, end)
+            if header_end == -1:
+                header_end = self._mmap.find(b'\n\r\n', start, end)
+            end = header_end + 1 if header_end != -1 else end
+        return self._mmap[start:end]
+
+    def search_uids(self, since_uid=None, since_date=None):
+        if self.mail is None:
+            if not self.connect():
+                return None
+        first = int(since_uid) + 1 if since_uid else 1
+        uids = [str(uid) for uid in self._uids() if uid >= first]
+        if since_date:
+            uids = [uid for uid in uids if self._received_since(uid, since_date)]
+        self.searched_uidnext = self.mailbox_state.get('uidnext')
+        return uids
+
+    def _received_since(self, uid, since_date):
+        try:
+            return parsedate_to_datetime(self._header_message(uid)['Date']).date() >= since_date
+        except Exception:
+            return True
+
+    def _header_message(self, uid):
+        raw = self._read(uid, headers_only=True) or b''
+        end = raw.find(b'\n\n')
+        if end == -1:
+            end = raw.find(b'\r\n\r\n')
+        return email.message_from_bytes(raw[:end] if end != -1 else raw)
+
+    def fetch_uid_batch(self, since_uid=None, batch_size=100, start_index=0, since_date=None):
+        return EmailClient._slice_batch(self.search_uids(since_uid, since_date) or [], batch_size, start_index)
+
+    def fetch_emails(self, since_date=None, since_uid=None, batch_size=100, start_index=0):
+        batch_ids, next_start_index = self.fetch_uid_batch(since_uid, batch_size, start_index, since_date)
+        if not batch_ids:
+            return [], None
+        return self.fetch_messages(batch_ids), next_start_index
+
+    def fetch_headers(self, uids, with_structure=False):
+        headers = []
+        for uid in uids:
+            if self.source_type == 'mbox':
+                index = int(uid) - 1
+                if index < 0 or index >= self._count():
+                    continue
+                size = self._offsets[index + 1] - self._offsets[index]
+            else:
+                if int(uid) not in self._paths:
+                    continue
+                size = os.path.getsize(self._paths[int(uid)])
+            headers.append({'uid': str(uid), 'message': self._header_message(uid), 'size': size})
+        return headers
+
+    def fetch_text_parts(self, headers, max_bytes=None):
+        # Nothing to save by reading sections separately, so return whole messages
+        return self.fetch_messages([h['uid'] for h in headers])
+
+    def fetch_messages(self, uids, parse=True):
+        emails = []
+        for uid in uids:
+            raw = self._read(uid)
+            if raw is None:
+                self.logger.warning(f"No message {uid} in {self.path}")
+                continue
+            emails.append({
+                'uid': str(uid),
+                'message': email.message_from_bytes(raw) if parse else None,
+                'raw': raw
+            })
+        return emails
+
+    def iter_messages(self, since_uid=None, chunk=25, uids=None):
+        if uids is None:
+            uids = self.search_uids(since_uid=since_uid) or []
+        queue = UidQueue(uids)
+        while queue:
+            for uid in queue.pop_batch(chunk):
+                raw = self._read(uid)
+                if raw is not None:
+                    yield {'uid': str(uid), 'message': email.message_from_bytes(raw)}
+
+    def wait_for_changes(self, timeout=None, poll_interval=60):
+        """Daemon support: poll the file or directory and re-index it when it changes."""
+        time.sleep(min(timeout or poll_interval, poll_interval))
+        if self._stat_signature() == self._signature:
+            return False
+        self.disconnect()
+        return self.connect()
+
+    def _stat_signature(self):
+        if self.source_type == 'mbox':
+            stat = os.stat(self.path)
+            return stat.st_size, stat.st_mtime
+        directories = [os.path.join(self.path, d) for d in ('new', 'cur')] if self.source_type == 'maildir' \
+            else [root for root, _, _ in os.walk(self.path)]
+        return tuple(os.stat(d).st_mtime for d in directories if os.path.isdir(d))
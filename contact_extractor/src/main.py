@@ -1,17 +1,51 @@
+import argparse
+import asyncio
+import contextvars
+import email
+import itertools
 import yaml
 import logging
 import os
-from email_client import EmailClient
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from email_client import EmailClient, IDLE_TIMEOUT
+from async_email_client import AsyncEmailClient
+from local_source import LocalMailSource, SOURCE_TYPES
+from message_cache import get_cache, DEFAULT_CACHE_MB
 from extractor import ContactExtractor
 from filters import EmailFilter
 from storage import StorageManager
+from imap_utils import UidQueue, build_message_set, expand_message_set, build_search_filter
+from pipeline import Pipeline
+from worker_pool import create_process_pool, create_replay_pool, classify_raw, replay_raw
+
+# Seconds to wait before reconnecting a dropped account in daemon mode,
+# doubled after every failed attempt up to MAX_RECONNECT_DELAY
+RECONNECT_DELAY = 30
+MAX_RECONNECT_DELAY = 15 * 60
+
+# Messages handed to the replay workers at a time, bounding the raw bytes held in memory
+REPLAY_CHUNK = 500
+# Contact fields compared when both rule sets accept the same sender
+REPLAY_FIELDS = ('name', 'phone', 'company', 'website', 'linkedin_id')
+
+# Account currently being processed by this thread / asyncio task, for log records
+current_account = contextvars.ContextVar('current_account', default='-')
+
+class AccountContextFilter(logging.Filter):
+    def filter(self, record):
+        record.account = current_account.get()
+        return True
 
 # Configure logging
+log_handler = logging.StreamHandler()
+log_handler.addFilter(AccountContextFilter())
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+    format='%(asctime)s - %(name)s - %(levelname)s - [%(account)s] %(message)s',
     handlers=[
-        logging.StreamHandler()
+        log_handler
     ]
 )
 
@@ -31,73 +65,687 @@ def load_accounts(filter_tags=None):
         logging.error(f"Error loading accounts: {str(e)}")
         return []
 
-def process_account(account, storage, extractor, email_filter, batch_size=100):
-    email_client = EmailClient(account)
-    if not email_client.connect():
-        logging.error(f"Failed to connect to {account['email']}")
+def account_folders(account):
+    """One account dict per folder listed under 'folders' in accounts.yaml (default: INBOX)."""
+    return [dict(account, folder=folder) for folder in account.get('folders') or [account.get('folder', 'INBOX')]]
+
+def checkpoint_key(account):
+    """
+    last_run.json key for one folder of an account. INBOX keeps the plain
+    account key, so checkpoints written before folders were supported stay valid.
+    """
+    folder = account.get('folder', 'INBOX')
+    return account['email'] if folder.upper() == 'INBOX' else f"{account['email']}/{folder}"
+
+def process_account(account, storage, extractor, email_filter, batch_size=100, process_pool=None):
+    """
+    Process every configured folder of an account. Folders run concurrently on
+    separate connections, at most 'folder_workers' (accounts.yaml, default 2)
+    at a time so servers with per-user connection limits are not exceeded.
+    """
+    folders = account_folders(account)
+    if len(folders) == 1:
+        process_folder(folders[0], storage, extractor, email_filter, batch_size, process_pool)
         return
 
+    workers = min(len(folders), int(account.get('folder_workers', 2)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='folder') as executor:
+        futures = [
+            executor.submit(process_folder, folder_account, storage, extractor, email_filter, batch_size, process_pool)
+            for folder_account in folders
+        ]
+        for future in futures:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"Folder worker failed for {account['email']}: {str(e)}")
+
+def create_client(account):
+    """EmailClient for IMAP accounts, LocalMailSource for 'source: mbox|maildir|eml' entries."""
+    if account.get('source') in SOURCE_TYPES:
+        return LocalMailSource(account)
+    return EmailClient(account)
+
+def process_folder(account, storage, extractor, email_filter, batch_size=100, process_pool=None):
+    token = current_account.set(checkpoint_key(account))
+    try:
+        email_client = create_client(account)
+        if not email_client.connect():
+            logging.error(f"Failed to connect to {account['email']}")
+            return
+
+        try:
+            sync_account(email_client, account, storage, extractor, email_filter, batch_size, process_pool)
+        finally:
+            email_client.disconnect()
+            logging.info(f"Disconnected from {account['email']}")
+    finally:
+        current_account.reset(token)
+
+def sync_account(email_client, account, storage, extractor, email_filter, batch_size=100, process_pool=None):
+    """Process everything new in the mailbox since the last checkpoint over a connected client."""
     try:
-        last_run = storage.load_last_run()
-        account_last_run = last_run.get(account['email'], {})
-        last_uid = account_last_run.get('last_uid')
+        last_uid, queue = run_plan(plan_queue(email_client, account, storage, extractor))
 
+        shards = int(account.get('shards', 1))
+        if account.get('pipeline'):
+            total_extracted = process_pipeline(
+                account, email_client, queue, last_uid, storage, extractor, email_filter,
+                batch_size, process_pool
+            )
+        elif shards > 1 and len(queue) > batch_size:
+            total_extracted = process_shards(
+                account, email_client, queue.split(shards), last_uid,
+                storage, extractor, email_filter, batch_size, process_pool
+            )
+        else:
+            total_extracted = run_plan(plan_batches(
+                email_client, account, queue, last_uid, storage, extractor, email_filter, batch_size, process_pool
+            ))
 
-        logging.info(f"Starting batch processing for {account['email']} (last_uid={last_uid})")
-        start_index = 0
-        max_uid_seen = int(last_uid) if last_uid else 0
-        total_extracted = 0
+        logging.info(f"Completed processing for {account['email']}. Total contacts extracted: {total_extracted}")
+
+    except Exception as e:
+        logging.error(f"Error processing account {account['email']}: {str(e)}")
 
+# The sync and async engines share one implementation of the checkpoint,
+# search, batch and fetch logic. A plan is a generator that yields the value
+# of each client call it makes: EmailClient calls return their result right
+# away, AsyncEmailClient calls return a coroutine. run_plan and
+# run_plan_async send each result back into the plan and return its value.
+
+def run_plan(plan):
+    """Run a plan over a blocking client (EmailClient, LocalMailSource)."""
+    result = None
+    try:
+        while True:
+            result = plan.send(result)
+    except StopIteration as done:
+        return done.value
+
+async def run_plan_async(plan):
+    """Run a plan over AsyncEmailClient, awaiting every call it yields."""
+    result = None
+    try:
         while True:
-            emails, next_start_index = email_client.fetch_emails(
-                since_uid=last_uid, batch_size=batch_size, start_index=start_index
+            result = await plan.send(result)
+    except StopIteration as done:
+        return done.value
+
+def plan_queue(email_client, account, storage, extractor):
+    """Plan: search what is new since the checkpoint and queue it with the pending UIDs. Returns (last_uid, UidQueue)."""
+    last_uid, pending_uids, search = load_checkpoint(storage, account, email_client.mailbox_state)
+    fetch_mode = account.get('fetch_mode', 'full')
+
+    logging.info(f"Starting batch processing for {account['email']} (last_uid={last_uid}, fetch_mode={fetch_mode})")
+    apply_server_filter(email_client, account, extractor)
+
+    # Search once per run and slice the result locally
+    new_uids = (yield email_client.search_uids(**search)) if search is not None else []
+    searched_uidnext = email_client.searched_uidnext if search is not None else None
+    return queue_uids(storage, account, last_uid, pending_uids, new_uids,
+                      email_client.mailbox_state, searched_uidnext)
+
+def plan_batches(email_client, account, queue, last_uid, storage, extractor, email_filter,
+                 batch_size=100, process_pool=None):
+    """Plan: fetch, process and checkpoint the queue batch by batch. Returns the number of contacts saved."""
+    fetch_mode = account.get('fetch_mode', 'full')
+    # Messages per UID FETCH when streaming a batch instead of materializing it
+    fetch_chunk = account.get('fetch_chunk')
+    batch_number = 0
+    total_extracted = 0
+    # UIDs the server returned no data for; they stay pending for the next run
+    unfetched = []
+
+    while queue:
+        batch_ids = queue.pop_batch(batch_size)
+        batch_number += 1
+
+        if fetch_chunk and fetch_mode == 'full' and process_pool is None and email_client.max_message_size is None:
+            saved, missing = yield from plan_stream(
+                email_client, batch_ids, int(fetch_chunk), account, storage, extractor, email_filter
             )
-            if not emails:
-                logging.info(f"No more emails to process for {account['email']} (start_index={start_index})")
-                break
+            total_extracted += saved
+        else:
+            emails, missing = yield from plan_fetch(
+                email_client, batch_ids, extractor, fetch_mode, parse=process_pool is None
+            )
+            logging.info(f"Fetched {len(emails)} emails for {account['email']} (batch {batch_number})")
+            total_extracted += process_batch(emails, account, storage, extractor, email_filter, process_pool)
+        unfetched += missing
+
+        # Checkpoint the UIDs still left from this run's search
+        storage.save_last_run(checkpoint_key(account), last_uid, pending_message_set(queue, unfetched))
+        logging.info(
+            f"Checkpointed {checkpoint_key(account)}: last_uid={last_uid}, "
+            f"{len(queue) + len(unfetched)} emails remaining"
+        )
+    return total_extracted
 
-            logging.info(f"Fetched {len(emails)} emails for {account['email']} (batch {start_index // batch_size + 1})")
-
-            recruiter_emails = email_filter.filter_recruiter_emails(emails, extractor)
-            logging.info(f"Filtered {len(recruiter_emails)} recruiter emails in this batch for {account['email']}")
-
-            contacts = []
-            for email_data in recruiter_emails:
-                try:
-                    contact = extractor.extract_contacts(email_data['message'], source_email=account['email'])
-                    if contact.get('email'):
-                        logging.info(f"Extracted contact: {contact}")
-                        contacts.append(contact)
-                    else:
-                        logging.info(f"Skipped non-recruiter email: {email_data['message'].get('From')}")
-                except Exception as e:
-                    logging.error(f"Error extracting contact: {str(e)}")
+def watch_account(account, storage, extractor, email_filter, stop_event, batch_size=100, process_pool=None,
+                  idle_timeout=IDLE_TIMEOUT, poll_interval=60):
+    """
+    Daemon loop for one account: keep a single authenticated connection, catch
+    up on anything that arrived while it was down, then wait for new mail with
+    IDLE (or NOOP polling) and push just the new UIDs through the usual
+    filter/extract/store path. account is a single-folder entry from account_folders.
+    """
+    token = current_account.set(checkpoint_key(account))
+    email_client = create_client(account)
+    needs_sync = True
+    delay = RECONNECT_DELAY
+    try:
+        while not stop_event.is_set():
+            if email_client.mail is None:
+                if not email_client.connect():
+                    logging.error(f"Failed to connect to {account['email']}, retrying in {delay}s")
+                    stop_event.wait(delay)
+                    delay = min(delay * 2, MAX_RECONNECT_DELAY)
                     continue
+                needs_sync = True
+                delay = RECONNECT_DELAY
+            if needs_sync:
+                sync_account(email_client, account, storage, extractor, email_filter, batch_size, process_pool)
+            needs_sync = email_client.wait_for_changes(idle_timeout, poll_interval)
+            if needs_sync:
+                logging.info(f"New mail for {account['email']}")
+    finally:
+        if email_client.mail is not None:
+            email_client.disconnect()
+        logging.info(f"Stopped watching {account['email']}")
+        current_account.reset(token)
 
-            contacts = deduplicate_contacts(contacts)
-            if contacts:
-                logging.info(f"Extracted {len(contacts)} contacts in this batch for {account['email']}")
-                storage.save_contacts(None, contacts)
-                total_extracted += len(contacts)
+def run_daemon(accounts, storage, extractor, email_filter, process_pool=None,
+               idle_timeout=IDLE_TIMEOUT, poll_interval=60):
+    """Watch every folder of every account in its own thread until interrupted."""
+    stop_event = threading.Event()
+    threads = []
+    for account in [folder_account for account in accounts for folder_account in account_folders(account)]:
+        thread = threading.Thread(
+            target=watch_account,
+            args=(account, storage, extractor, email_filter, stop_event),
+            kwargs={'process_pool': process_pool, 'idle_timeout': idle_timeout, 'poll_interval': poll_interval},
+            name=f"watch-{checkpoint_key(account)}",
+            daemon=True
+        )
+        thread.start()
+        threads.append(thread)
 
-            # Update max_uid_seen
-            batch_uids = [int(email['uid']) for email in emails if email.get('uid')]
-            if batch_uids:
-                max_uid_seen = max(max_uid_seen, max(batch_uids))
-                storage.save_last_run(account['email'], str(max_uid_seen))
-                logging.info(f"Updated last_uid for {account['email']} to {max_uid_seen}")
+    try:
+        # Join with a timeout so Ctrl+C still reaches the main thread
+        while any(thread.is_alive() for thread in threads):
+            for thread in threads:
+                thread.join(1)
+    except KeyboardInterrupt:
+        logging.info("Stopping daemon")
+        stop_event.set()
 
-            if not next_start_index:
-                break
-            start_index = next_start_index
+async def process_account_async(account, storage, extractor, email_filter, batch_size=100):
+    """
+    Coroutine version of process_folder built on AsyncEmailClient, running the
+    same plans as sync_account. Filtering, extraction and storage stay
+    synchronous; they run between network waits on the event loop thread, so
+    StorageManager is never used concurrently. 'pipeline' and 'shards' need
+    extra threads and connections and are ignored by this engine.
+    account is a single-folder entry from account_folders.
+    """
+    token = current_account.set(checkpoint_key(account))
+    email_client = AsyncEmailClient(account)
+    if not await email_client.connect():
+        logging.error(f"Failed to connect to {account['email']}")
+        current_account.reset(token)
+        return
+
+    try:
+        for option in ('pipeline', 'shards'):
+            if account.get(option):
+                logging.warning(f"'{option}' is not supported by the async engine, ignoring it for {account['email']}")
+
+        last_uid, queue = await run_plan_async(plan_queue(email_client, account, storage, extractor))
+        total_extracted = await run_plan_async(plan_batches(
+            email_client, account, queue, last_uid, storage, extractor, email_filter, batch_size
+        ))
 
         logging.info(f"Completed processing for {account['email']}. Total contacts extracted: {total_extracted}")
 
     except Exception as e:
         logging.error(f"Error processing account {account['email']}: {str(e)}")
     finally:
-        email_client.disconnect()
+        await email_client.disconnect()
         logging.info(f"Disconnected from {account['email']}")
+        current_account.reset(token)
+
+def run_accounts_threaded(accounts, storage, extractor, email_filter, workers=4, process_pool=None):
+    """
+    Process accounts on a thread pool. Each account gets its own EmailClient and
+    connection; StorageManager serializes the shared CSV and last_run.json writes.
+    """
+    def run(account):
+        token = current_account.set(account['email'])
+        try:
+            logging.info(f"Processing account: {account['email']}")
+            process_account(account, storage, extractor, email_filter, process_pool=process_pool)
+        finally:
+            current_account.reset(token)
+
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='account') as executor:
+        for future in [executor.submit(run, account) for account in accounts]:
+            try:
+                future.result()
+            except Exception as e:
+                logging.error(f"Account worker failed: {str(e)}")
+
+async def run_accounts_async(accounts, storage, extractor, email_filter, concurrency=10, per_server=4):
+    """
+    Process all accounts concurrently on one event loop, with at most
+    `concurrency` folders in flight overall and `per_server` per IMAP server.
+    Every folder of an account uses its own connection.
+    """
+    global_limit = asyncio.Semaphore(concurrency)
+    server_limits = {}
+
+    async def run(account):
+        if account.get('source') in SOURCE_TYPES:
+            # Local sources are plain file reads; run them off the event loop
+            async with global_limit:
+                await asyncio.to_thread(process_folder, account, storage, extractor, email_filter)
+            return
+        server_limit = server_limits.setdefault(account['imap_server'], asyncio.Semaphore(per_server))
+        async with server_limit:
+            async with global_limit:
+                logging.info(f"Processing account: {checkpoint_key(account)}")
+                await process_account_async(account, storage, extractor, email_filter)
+
+    await asyncio.gather(*(
+        run(folder_account) for account in accounts for folder_account in account_folders(account)
+    ))
+
+def process_pipeline(account, email_client, queue, last_uid, storage, extractor, email_filter,
+                     batch_size=100, process_pool=None):
+    """
+    Streaming alternative to the batch loop: fetch, parse, filter, extract and
+    store run as separate stages connected by bounded queues, so the next batch
+    downloads while the previous ones are processed. Worker counts come from
+    the account's pipeline settings, e.g.
+
+        pipeline: {fetch: 2, parse: 1, filter: 2, extract: 2, queue_size: 4}
+
+    Each fetch worker uses its own connection (the first reuses email_client).
+    A batch stays in the checkpoint's pending UIDs until the store stage has
+    saved it, however the stages interleave. With a process_pool, parse, filter
+    and extract collapse into one stage that ships raw bytes to the pool.
+    Returns the number of contacts saved.
+    """
+    settings = account.get('pipeline')
+    settings = settings if isinstance(settings, dict) else {}
+    fetch_mode = account.get('fetch_mode', 'full')
+    lock = threading.Lock()
+    in_flight = {}
+    unfetched = []
+    batch_numbers = itertools.count(1)
+    totals = {'saved': 0}
+
+    def checkpoint():
+        with lock:
+            in_flight_uids = [uid for uids in in_flight.values() for uid in uids]
+            pending = pending_message_set(queue, unfetched + in_flight_uids)
+            remaining = len(queue) + len(unfetched) + len(in_flight_uids)
+        storage.save_last_run(checkpoint_key(account), last_uid, pending)
+        return remaining
+
+    def fetch(index):
+        client = email_client if index == 0 else create_client(account)
+        if index > 0 and not client.connect():
+            logging.error(f"Pipeline fetch worker {index} failed to connect for {account['email']}")
+            return
+        try:
+            while True:
+                with lock:
+                    if not queue:
+                        return
+                    batch_ids = queue.pop_batch(batch_size)
+                    number = next(batch_numbers)
+                    in_flight[number] = batch_ids
+                emails, missing = fetch_batch(client, batch_ids, extractor, fetch_mode, parse=False)
+                logging.info(f"Fetched {len(emails)} emails for {account['email']} (batch {number})")
+                yield {'number': number, 'emails': emails, 'unfetched': missing}
+        finally:
+            if index > 0:
+                client.disconnect()
+
+    def parse(batch):
+        for email_data in batch['emails']:
+            if email_data['message'] is None:
+                email_data['message'] = email.message_from_bytes(email_data['raw'])
+        return batch
+
+    def filter_stage(batch):
+        batch['emails'] = email_filter.filter_recruiter_emails(batch['emails'], extractor)
+        logging.info(f"Filtered {len(batch['emails'])} recruiter emails in batch {batch['number']} for {account['email']}")
+        return batch
+
+    def extract(batch):
+        batch['contacts'] = extract_batch(batch['emails'], account, extractor)
+        return batch
+
+    def store(batch):
+        saved = save_batch(batch['contacts'], account, storage)
+        with lock:
+            totals['saved'] += saved
+            in_flight.pop(batch['number'], None)
+            unfetched.extend(batch['unfetched'])
+        remaining = checkpoint()
+        logging.info(f"Checkpointed {account['email']}: last_uid={last_uid}, {remaining} emails remaining")
+
+    def classify(batch):
+        batch['contacts'] = classify_batch(batch['emails'], account, process_pool)
+        return batch
+
+    pipeline = Pipeline(queue_size=settings.get('queue_size', 4))
+    if process_pool is not None:
+        pipeline.add_stage('classify', classify, settings.get('classify', 2))
+    else:
+        pipeline.add_stage('parse', parse, settings.get('parse', 1))
+        pipeline.add_stage('filter', filter_stage, settings.get('filter', 1))
+        pipeline.add_stage('extract', extract, settings.get('extract', 1))
+    # A single store worker keeps CSV appends and checkpoints in order
+    pipeline.add_stage('store', store, 1)
+    pipeline.run(fetch, source_workers=settings.get('fetch', 1))
+    return totals['saved']
+
+def load_checkpoint(storage, account, mailbox_state):
+    """
+    Return (last_uid, pending_uids, search) for this run, where search holds the
+    search_uids arguments, or None when the mailbox cannot have new mail: same
+    UIDVALIDITY and either an unchanged HIGHESTMODSEQ (CONDSTORE) or a UIDNEXT
+    that has not moved past last_uid. Such a run costs only the SELECT.
+    If UIDVALIDITY changed, or UIDNEXT fell below last_uid, the saved UIDs mean
+    nothing any more: they are dropped and the mailbox is resynced by date from
+    shortly before the last run.
+    """
+    account_last_run = storage.load_last_run().get(checkpoint_key(account), {})
+    last_uid = account_last_run.get('last_uid')
+    pending_uids = expand_message_set(account_last_run.get('pending_uids'))
+    saved_validity = account_last_run.get('uidvalidity')
+    current_validity = mailbox_state.get('uidvalidity')
+    uidnext = mailbox_state.get('uidnext')
+
+    validity_changed = saved_validity and current_validity and saved_validity != current_validity
+    # UIDNEXT never moves back under one UIDVALIDITY; if it did, the UIDs were reassigned
+    uidnext_went_back = last_uid and uidnext and uidnext - 1 < int(last_uid)
+    if validity_changed or uidnext_went_back:
+        since_date = None
+        if account_last_run.get('last_run'):
+            since_date = (datetime.fromisoformat(account_last_run['last_run']) - timedelta(days=1)).date()
+        reason = (f"UIDVALIDITY changed ({saved_validity} -> {current_validity})" if validity_changed
+                  else f"UIDNEXT went back ({int(last_uid) + 1} -> {uidnext})")
+        logging.warning(
+            f"{reason} for {checkpoint_key(account)}, resyncing mail since {since_date or 'the beginning'}"
+        )
+        return None, [], {'since_date': since_date}
+
+    if pending_uids:
+        logging.info(f"Resuming {len(pending_uids)} unprocessed emails from the previous run for {account['email']}")
+
+    saved_modseq = account_last_run.get('highestmodseq')
+    if last_uid and saved_validity == current_validity and (
+        (saved_modseq and saved_modseq == mailbox_state.get('highestmodseq'))
+        or (uidnext and uidnext <= int(last_uid) + 1)
+    ):
+        logging.info(f"No new mail for {account['email']} since the last run, skipping search")
+        return last_uid, pending_uids, None
+    return last_uid, pending_uids, {'since_uid': last_uid}
+
+def queue_uids(storage, account, last_uid, pending_uids, new_uids, mailbox_state=None, searched_uidnext=None):
+    """
+    Merge freshly searched UIDs with those left over from an interrupted run and
+    checkpoint the combined queue, with the mailbox state it belongs to, before
+    any of it is processed. new_uids is None if the search failed; the saved
+    mailbox state is then left as it was, so the next run does not mistake the
+    unsearched mailbox for an unchanged one. searched_uidnext is the UIDNEXT
+    the search covered, if it succeeded. Returns (last_uid, UidQueue).
+    """
+    if new_uids is None:
+        logging.warning(f"Search failed for {account['email']}, will search again on the next run")
+        new_uids = []
+        mailbox_state = None
+        searched_uidnext = None
+    queue = UidQueue(set(pending_uids) | set(new_uids))
+    if new_uids:
+        last_uid = new_uids[-1]
+    if searched_uidnext and int(last_uid or 0) < searched_uidnext - 1:
+        # Every older UID was considered by the search, even the ones that did
+        # not match (e.g. with a server-side filter)
+        last_uid = str(searched_uidnext - 1)
+    if last_uid:
+        storage.save_last_run(checkpoint_key(account), last_uid, queue.message_set(), mailbox_state)
+    logging.info(f"Found {len(new_uids)} new emails for {account['email']} ({len(queue)} to process)")
+    return last_uid, queue
+
+def apply_server_filter(email_client, account, extractor):
+    """
+    With 'server_filter: true' in accounts.yaml, let the server drop messages
+    that cannot match the recruiter rules, so they are never downloaded.
+    Gmail is left unfiltered: its SEARCH and X-GM-RAW match whole words, so
+    'recruit' would miss 'recruiter' and the mail would be skipped for good.
+    """
+    if not account.get('server_filter'):
+        return
+    if 'X-GM-EXT-1' in email_client.capabilities:
+        logging.warning(f"Gmail search matches whole words only, filtering {account['email']} locally only")
+        return
+    email_client.search_filter = build_search_filter(extractor.rules)
+    if email_client.search_filter is None:
+        logging.warning(f"Rules cannot be expressed as an IMAP search for {account['email']}, filtering locally only")
+
+def process_shards(account, email_client, shard_queues, last_uid, storage, extractor, email_filter,
+                   batch_size=100, process_pool=None):
+    """
+    Fetch contiguous UID ranges of one mailbox in parallel, one IMAP connection
+    per shard (the first shard reuses email_client). A batch is removed from
+    its shard queue only after it has been saved, and every checkpoint records
+    the union of all shards' remaining UIDs, so a failed shard's range is
+    picked up by the next run. Returns the number of contacts saved.
+    """
+    fetch_mode = account.get('fetch_mode', 'full')
+    lock = threading.Lock()
+    unfetched = []
+    logging.info(f"Fetching {account['email']} over {len(shard_queues)} connections")
+
+    def checkpoint():
+        # Saved under the lock, so a slower shard cannot overwrite a newer checkpoint with an older one
+        with lock:
+            pending = ','.join(q.message_set() for q in shard_queues + [UidQueue(unfetched)] if q)
+            storage.save_last_run(checkpoint_key(account), last_uid, pending)
+            return sum(len(q) for q in shard_queues) + len(unfetched)
+
+    def run_shard(index, shard_queue):
+        token = current_account.set(f"{checkpoint_key(account)}#{index}")
+        client = email_client if index == 0 else create_client(account)
+        if index > 0 and not client.connect():
+            logging.error(f"Shard {index} failed to connect; its UIDs stay pending")
+            current_account.reset(token)
+            return 0
+
+        total = 0
+        try:
+            while shard_queue:
+                batch_ids = shard_queue.peek_batch(batch_size)
+                emails, missing = fetch_batch(client, batch_ids, extractor, fetch_mode, parse=process_pool is None)
+                logging.info(f"Shard {index} fetched {len(emails)} emails for {account['email']}")
+                total += process_batch(emails, account, storage, extractor, email_filter, process_pool)
+                with lock:
+                    shard_queue.pop_batch(len(batch_ids))
+                    unfetched.extend(missing)
+                remaining = checkpoint()
+                logging.info(f"Checkpointed {account['email']}: last_uid={last_uid}, {remaining} emails remaining")
+        except Exception as e:
+            logging.error(f"Shard {index} stopped for {account['email']}: {str(e)}")
+        finally:
+            if index > 0:
+                client.disconnect()
+            current_account.reset(token)
+        return total
+
+    with ThreadPoolExecutor(max_workers=len(shard_queues), thread_name_prefix='shard') as executor:
+        futures = [executor.submit(run_shard, index, q) for index, q in enumerate(shard_queues)]
+        return sum(future.result() for future in futures)
+
+def process_batch(emails, account, storage, extractor, email_filter, process_pool=None):
+    """Filter, extract and save contacts for one fetched batch. Returns the number of contacts saved."""
+    if process_pool is not None:
+        return save_batch(classify_batch(emails, account, process_pool), account, storage)
+
+    recruiter_emails = email_filter.filter_recruiter_emails(emails, extractor)
+    logging.info(f"Filtered {len(recruiter_emails)} recruiter emails in this batch for {account['email']}")
+    return save_batch(extract_batch(recruiter_emails, account, extractor), account, storage)
+
+def plan_stream(email_client, batch_ids, chunk, account, storage, extractor, email_filter):
+    """
+    Plan: like fetching and processing a whole batch, but downloads `chunk`
+    messages at a time and parses them one by one, dropping each raw copy as
+    soon as it is parsed and keeping only the extracted contacts, so a whole
+    batch of messages is never held in memory. Returns (saved, unfetched).
+    """
+    contacts = []
+    unfetched = []
+    count = 0
+    recruiter_count = 0
+    for start in range(0, len(batch_ids), chunk):
+        chunk_ids = batch_ids[start:start + chunk]
+        emails = yield email_client.fetch_messages(chunk_ids, parse=False)
+        unfetched += missing_uids(chunk_ids, emails)
+        emails.reverse()
+        while emails:
+            email_data = emails.pop()
+            email_data['message'] = email.message_from_bytes(email_data.pop('raw'))
+            count += 1
+            recruiter_emails = email_filter.filter_recruiter_emails([email_data], extractor)
+            recruiter_count += len(recruiter_emails)
+            contacts.extend(extract_batch(recruiter_emails, account, extractor))
+    logging.info(f"Streamed {count} emails ({recruiter_count} recruiter emails) for {account['email']}")
+    return save_batch(deduplicate_contacts(contacts), account, storage), unfetched
+
+def classify_batch(emails, account, process_pool):
+    """
+    Parse, filter and extract a batch in worker processes (see worker_pool).
+    Only raw bytes go out and only verdicts and contact dicts come back.
+    """
+    raws = [e['raw'] if e['raw'] is not None else e['message'].as_bytes() for e in emails]
+    if not raws:
+        return []
+    # A few tasks per batch keeps pickling overhead low while still spreading work
+    chunksize = max(1, len(raws) // 16)
+    results = process_pool.map(classify_raw, raws, itertools.repeat(account['email']), chunksize=chunksize)
+
+    contacts = []
+    recruiter_count = 0
+    for email_data, (sender, is_recruiter, contact) in zip(emails, results):
+        if contact and email_data.get('body_truncated'):
+            contact['body_truncated'] = True
+        if not is_recruiter:
+            logging.info(f"Non-recruiter email skipped: {sender}")
+            continue
+        recruiter_count += 1
+        if contact and contact.get('email'):
+            logging.info(f"Extracted contact: {contact}")
+            contacts.append(contact)
+        else:
+            logging.info(f"Skipped non-recruiter email: {sender}")
+    logging.info(f"Filtered {recruiter_count} recruiter emails in this batch for {account['email']}")
+    return deduplicate_contacts(contacts)
+
+def extract_batch(recruiter_emails, account, extractor):
+    """Extract and de-duplicate contacts from a batch of recruiter emails."""
+    contacts = []
+    for email_data in recruiter_emails:
+        try:
+            contact = extractor.extract_contacts(email_data['message'], source_email=account['email'])
+            if email_data.get('body_truncated'):
+                contact['body_truncated'] = True
+            if contact.get('email'):
+                logging.info(f"Extracted contact: {contact}")
+                contacts.append(contact)
+            else:
+                logging.info(f"Skipped non-recruiter email: {email_data['message'].get('From')}")
+        except Exception as e:
+            logging.error(f"Error extracting contact: {str(e)}")
+            continue
+    return deduplicate_contacts(contacts)
+
+def save_batch(contacts, account, storage):
+    if not contacts:
+        return 0
+    logging.info(f"Extracted {len(contacts)} contacts in this batch for {account['email']}")
+    storage.save_contacts(None, contacts)
+    return len(contacts)
+
+def fetch_batch(email_client, batch_ids, extractor, fetch_mode='full', parse=True):
+    """Download one batch over a blocking client; see plan_fetch. Returns (emails, unfetched)."""
+    return run_plan(plan_fetch(email_client, batch_ids, extractor, fetch_mode, parse))
+
+def plan_fetch(email_client, batch_ids, extractor, fetch_mode='full', parse=True):
+    """
+    Plan: download one batch of messages. In 'headers_first' mode only From/Subject/Date
+    are fetched up front and bodies are downloaded just for senders that pass
+    the header checks. 'text_parts' does the same but downloads only the
+    text/plain MIME sections instead of the whole message.
+    With parse=False full messages are returned unparsed (message=None).
+    If the client has a max_message_size, sizes are fetched first in every mode
+    and oversized messages only get the start of their text parts downloaded.
+    Returns (emails, unfetched), where unfetched lists the UIDs the server sent
+    no data for; they belong in the checkpoint's pending UIDs, not skipped.
+    """
+    size_capped = email_client.max_message_size is not None
+    if fetch_mode not in ('headers_first', 'text_parts') and not size_capped:
+        emails = yield email_client.fetch_messages(batch_ids, parse=parse)
+        return emails, missing_uids(batch_ids, emails)
+
+    headers = yield email_client.fetch_headers(batch_ids, with_structure=(fetch_mode == 'text_parts' or size_capped))
+    unfetched = missing_uids(batch_ids, headers)
+    if fetch_mode in ('headers_first', 'text_parts'):
+        headers = select_candidates(email_client, headers, len(batch_ids), extractor)
+    headers, oversized = split_oversized(email_client, headers)
+
+    if fetch_mode == 'text_parts':
+        emails = yield email_client.fetch_text_parts(headers)
+    else:
+        emails = yield email_client.fetch_messages([h['uid'] for h in headers], parse=parse)
+    if oversized:
+        emails += yield email_client.fetch_text_parts(oversized, max_bytes=email_client.partial_size)
+    return emails, unfetched + missing_uids([h['uid'] for h in headers + oversized], emails)
+
+def missing_uids(uids, fetched):
+    """The UIDs in uids with no entry in fetched (email or header dicts)."""
+    fetched_uids = {str(e['uid']) for e in fetched}
+    return [str(uid) for uid in uids if str(uid) not in fetched_uids]
+
+def pending_message_set(queue, unfetched):
+    """Message set of the UIDs still queued plus those the server sent no data for."""
+    return ','.join(p for p in (queue.message_set(), build_message_set(unfetched)) if p)
+
+def split_oversized(email_client, headers):
+    """Split fetched headers into (regular, oversized) by the client's max_message_size."""
+    if email_client.max_message_size is None:
+        return headers, []
+    regular = [h for h in headers if (h['size'] or 0) <= email_client.max_message_size]
+    oversized = [h for h in headers if (h['size'] or 0) > email_client.max_message_size]
+    if oversized:
+        logging.info(
+            f"Fetching only the first {email_client.partial_size // 1024} KB of text for "
+            f"{len(oversized)} oversized emails in {email_client.email}"
+        )
+    return regular, oversized
+
+def select_candidates(email_client, headers, batch_count, extractor):
+    candidates = [h for h in headers if extractor.is_candidate_sender(h['message'])]
+    candidate_uids = {h['uid'] for h in candidates}
+    skipped_bytes = sum(h['size'] or 0 for h in headers if h['uid'] not in candidate_uids)
+    logging.info(
+        f"{len(candidates)}/{batch_count} emails passed header checks for {email_client.email} "
+        f"(skipped {skipped_bytes // 1024} KB of message bodies)"
+    )
+    return candidates
 
 def deduplicate_contacts(contacts):
     seen = set()
@@ -111,7 +759,142 @@ def deduplicate_contacts(contacts):
             logging.info(f"Duplicate contact, not saving: {contact['email']}")
     return unique_contacts
 
+def iter_stored_messages(accounts):
+    """
+    Yield (account email, raw message) for every message available locally:
+    the message cache of IMAP accounts with 'cache' enabled and the files of
+    mbox, Maildir and .eml sources. Nothing is fetched from a server.
+    """
+    for account in accounts:
+        if account.get('source') in SOURCE_TYPES:
+            source = LocalMailSource(account)
+            if not source.connect():
+                continue
+            try:
+                queue = UidQueue(source.search_uids() or [])
+                while queue:
+                    for email_data in source.fetch_messages(queue.pop_batch(REPLAY_CHUNK), parse=False):
+                        yield account['email'], email_data['raw']
+            finally:
+                source.disconnect()
+        elif account.get('cache'):
+            cache = get_cache(account.get('cache_mb', DEFAULT_CACHE_MB))
+            for _, _, _, raw in cache.iter_messages(account['email']):
+                yield account['email'], raw
+        else:
+            logging.warning(f"No stored messages to replay for {account['email']} (enable 'cache' to keep them)")
+
+def run_replay(accounts, storage, rules_path, baseline_rules_path=None, processes=0):
+    """
+    Re-run classification and extraction over stored messages under both the
+    baseline rules (default config/rules.yaml) and the rules in rules_path, in
+    worker processes, and report which contacts the new rules gain, lose or
+    extract differently. No IMAP connection is made and output.csv is untouched.
+    Returns a summary dict, or None if the new rules could not be loaded.
+    """
+    if not ContactExtractor(rules_path).rules:
+        logging.error(f"No rules loaded from {rules_path}, not replaying")
+        return None
+
+    processes = processes or os.cpu_count() or 1
+    baseline, candidate = {}, {}
+    message_count = 0
+    flipped = 0
+    messages = iter_stored_messages(accounts)
+    with create_replay_pool(processes, baseline_rules_path, rules_path) as pool:
+        while True:
+            chunk = list(itertools.islice(messages, REPLAY_CHUNK))
+            if not chunk:
+                break
+            sources, raws = zip(*chunk)
+            del chunk
+            chunksize = max(1, len(raws) // (processes * 4))
+            for sender, old_contact, new_contact in pool.map(replay_raw, raws, sources, chunksize=chunksize):
+                message_count += 1
+                if (old_contact is None) != (new_contact is None):
+                    flipped += 1
+                    logging.info(f"Verdict changed for {sender}: {'accepted' if new_contact else 'rejected'} by new rules")
+                if old_contact:
+                    baseline.setdefault(old_contact['email'], old_contact)
+                if new_contact:
+                    candidate.setdefault(new_contact['email'], new_contact)
+
+    rows = diff_contacts(baseline, candidate)
+    summary = {
+        'messages': message_count,
+        'flipped': flipped,
+        'baseline_contacts': len(baseline),
+        'new_contacts': len(candidate),
+        'added': sum(row['change'] == 'added' for row in rows),
+        'removed': sum(row['change'] == 'removed' for row in rows),
+        'changed': sum(row['change'] == 'changed' for row in rows),
+    }
+    logging.info(
+        f"Replayed {message_count} messages with {rules_path}: {flipped} verdicts changed; "
+        f"{summary['baseline_contacts']} -> {summary['new_contacts']} contacts "
+        f"({summary['added']} added, {summary['removed']} removed, {summary['changed']} changed)"
+    )
+    storage.save_replay_report(rows)
+    return summary
+
+def diff_contacts(baseline, candidate):
+    """Report rows for senders accepted by only one rule set or extracted differently by the two."""
+    rows = []
+    for email_address in sorted(baseline.keys() | candidate.keys()):
+        old_contact = baseline.get(email_address)
+        new_contact = candidate.get(email_address)
+        if old_contact is None:
+            rows.append(dict(new_contact, change='added', details=''))
+        elif new_contact is None:
+            rows.append(dict(old_contact, change='removed', details=''))
+        else:
+            details = '; '.join(
+                f"{field}: {old_contact.get(field)} -> {new_contact.get(field)}"
+                for field in REPLAY_FIELDS if old_contact.get(field) != new_contact.get(field)
+            )
+            if details:
+                rows.append(dict(new_contact, change='changed', details=details))
+    return rows
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Extract recruiter contacts from IMAP mailboxes")
+    parser.add_argument('--engine', choices=['sync', 'async'], default='sync',
+                        help="'async' processes all accounts concurrently on one asyncio event loop")
+    parser.add_argument('--concurrency', type=int, default=10,
+                        help="Maximum number of accounts processed at once (async engine)")
+    parser.add_argument('--per-server', type=int, default=4,
+                        help="Maximum concurrent connections to a single IMAP server (async engine)")
+    parser.add_argument('--workers', type=int, default=1,
+                        help="Number of accounts processed in parallel threads (sync engine)")
+    parser.add_argument('--processes', type=int, default=0,
+                        help="Parse and classify messages in this many worker processes (sync engine; --replay defaults to one per CPU)")
+    parser.add_argument('--daemon', action='store_true',
+                        help="Keep running and process new mail as it arrives, using IMAP IDLE (sync engine)")
+    parser.add_argument('--idle-timeout', type=int, default=IDLE_TIMEOUT,
+                        help="Seconds to stay in IDLE before re-issuing it (daemon mode)")
+    parser.add_argument('--poll-interval', type=int, default=60,
+                        help="Seconds between NOOP polls for servers without IDLE (daemon mode)")
+    parser.add_argument('--replay', metavar='RULES',
+                        help="Re-evaluate cached and local messages with the rules in RULES and report "
+                             "the contacts gained and lost in data/replay_diff.csv; no mail is fetched")
+    parser.add_argument('--domain-cache', action='store_true',
+                        help="Keep sender domain verdicts in data/domain_verdicts.json between runs")
+    parser.add_argument('--baseline-rules', metavar='RULES',
+                        help="Rules to compare against in --replay (default: config/rules.yaml)")
+    args = parser.parse_args()
+    if args.engine == 'async' and not args.replay:
+        # The async engine runs everything on one event loop thread
+        unsupported = [
+            flag for flag, used in (('--daemon', args.daemon), ('--workers', args.workers > 1),
+                                    ('--processes', args.processes > 0))
+            if used
+        ]
+        if unsupported:
+            parser.error(f"{', '.join(unsupported)} cannot be used with --engine async")
+    return args
+
 def main():
+    args = parse_args()
     logging.info("Starting email contact extraction")
 
     accounts = load_accounts(filter_tags=["job_search"])
@@ -122,13 +905,40 @@ def main():
         return
 
     storage = StorageManager()
-    extractor = ContactExtractor()
+    verdict_cache_path = os.path.join(storage.data_dir, 'domain_verdicts.json') if args.domain_cache else None
+    extractor = ContactExtractor(verdict_cache_path=verdict_cache_path)
     email_filter = EmailFilter()
 
-    for account in accounts:
-        logging.info(f"Processing account: {account['email']}")
-        process_account(account, storage, extractor, email_filter)
+    if args.replay:
+        run_replay(accounts, storage, args.replay, args.baseline_rules, processes=args.processes)
+    elif args.engine == 'async':
+        asyncio.run(run_accounts_async(
+            accounts, storage, extractor, email_filter,
+            concurrency=args.concurrency, per_server=args.per_server
+        ))
+    else:
+        process_pool = create_process_pool(args.processes) if args.processes > 0 else None
+        try:
+            if args.daemon:
+                run_daemon(
+                    accounts, storage, extractor, email_filter, process_pool=process_pool,
+                    idle_timeout=args.idle_timeout, poll_interval=args.poll_interval
+                )
+            elif args.workers > 1:
+                run_accounts_threaded(
+                    accounts, storage, extractor, email_filter,
+                    workers=args.workers, process_pool=process_pool
+                )
+            else:
+                for account in accounts:
+                    logging.info(f"Processing account: {account['email']}")
+                    process_account(account, storage, extractor, email_filter, process_pool=process_pool)
+        finally:
+            if process_pool is not None:
+                process_pool.shutdown()
 
+    extractor.save_domain_verdicts()
+    extractor.log_stage_counts()
     logging.info("Email contact extraction completed")
 
 if __name__ == "__main__":
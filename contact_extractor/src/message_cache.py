@@ -0,0 +1,148 @@
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+
+DEFAULT_CACHE_MB = 2048
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_cache(max_mb=DEFAULT_CACHE_MB, directory=None):
+    """Return the process-wide MessageCache for directory (default data/message_cache)."""
+    if directory is None:
+        base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        directory = os.path.join(base_dir, 'data', 'message_cache')
+    with _caches_lock:
+        if directory not in _caches:
+            _caches[directory] = MessageCache(directory, int(max_mb) * 1024 * 1024)
+        return _caches[directory]
+
+
+class MessageCache:
+    """
+    On-disk cache of raw messages. Bodies are stored once per SHA-256 digest,
+    zlib-compressed, under objects/; an SQLite index maps
+    (account, folder, UIDVALIDITY, UID) to a digest. Identical messages, such
+    as Gmail's INBOX and All Mail copies, are stored once. When the compressed
+    total exceeds max_bytes the least recently used bodies are evicted.
+    """
+
+    def __init__(self, directory, max_bytes):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        os.makedirs(os.path.join(directory, 'objects'), exist_ok=True)
+        self._db = sqlite3.connect(os.path.join(directory, 'index.sqlite'), check_same_thread=False)
+        with self._db:
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS messages ('
+                'account TEXT, folder TEXT, uidvalidity INTEGER, uid INTEGER, digest TEXT, '
+                'PRIMARY KEY (account, folder, uidvalidity, uid))'
+            )
+            self._db.execute('CREATE INDEX IF NOT EXISTS messages_digest ON messages (digest)')
+            self._db.execute(
+                'CREATE TABLE IF NOT EXISTS objects (digest TEXT PRIMARY KEY, size INTEGER, last_used REAL)'
+            )
+        self._total = self._db.execute('SELECT COALESCE(SUM(size), 0) FROM objects').fetchone()[0]
+
+    def get_many(self, account, folder, uidvalidity, uids):
+        """Return {uid: raw bytes} for the cached subset of uids."""
+        if uidvalidity is None or not uids:
+            return {}
+        found = {}
+        with self._lock:
+            rows = []
+            for uid in uids:
+                row = self._db.execute(
+                    'SELECT digest FROM messages WHERE account=? AND folder=? AND uidvalidity=? AND uid=?',
+                    (account, folder, uidvalidity, int(uid))
+                ).fetchone()
+                if row:
+                    rows.append((str(uid), row[0]))
+            now = time.time()
+            for uid, digest in rows:
+                raw = self._read_object(digest)
+                if raw is not None:
+                    found[uid] = raw
+                    self._db.execute('UPDATE objects SET last_used=? WHERE digest=?', (now, digest))
+            self._db.commit()
+        return found
+
+    def put_many(self, account, folder, uidvalidity, messages):
+        """Store {uid: raw bytes}, then evict old bodies if the cache is over its size limit."""
+        if uidvalidity is None or not messages:
+            return
+        with self._lock:
+            now = time.time()
+            for uid, raw in messages.items():
+                digest = hashlib.sha256(raw).hexdigest()
+                if not self._db.execute('SELECT 1 FROM objects WHERE digest=?', (digest,)).fetchone():
+                    size = self._write_object(digest, raw)
+                    self._db.execute('INSERT INTO objects VALUES (?, ?, ?)', (digest, size, now))
+                    self._total += size
+                else:
+                    self._db.execute('UPDATE objects SET last_used=? WHERE digest=?', (now, digest))
+                self._db.execute(
+                    'INSERT OR REPLACE INTO messages VALUES (?, ?, ?, ?, ?)',
+                    (account, folder, uidvalidity, int(uid), digest)
+                )
+            self._evict()
+            self._db.commit()
+
+    def iter_messages(self, account=None):
+        """Yield (account, folder, uid, raw) for every cached message, optionally for one account."""
+        query = 'SELECT account, folder, uid, digest FROM messages'
+        params = ()
+        if account:
+            query += ' WHERE account=?'
+            params = (account,)
+        with self._lock:
+            rows = self._db.execute(query + ' ORDER BY account, folder, uid', params).fetchall()
+        for account_name, folder, uid, digest in rows:
+            raw = self._read_object(digest)
+            if raw is not None:
+                yield account_name, folder, str(uid), raw
+
+    def _evict(self):
+        if self._total <= self.max_bytes:
+            return
+        evicted = 0
+        for digest, size in self._db.execute('SELECT digest, size FROM objects ORDER BY last_used').fetchall():
+            if self._total <= self.max_bytes * 0.9:
+                break
+            self._db.execute('DELETE FROM objects WHERE digest=?', (digest,))
+            self._db.execute('DELETE FROM messages WHERE digest=?', (digest,))
+            try:
+                os.remove(self._object_path(digest))
+            except OSError:
+                pass
+            self._total -= size
+            evicted += 1
+        self.logger.info(f"Evicted {evicted} messages from the cache ({self._total // (1024 * 1024)} MB left)")
+
+    def _object_path(self, digest):
+        return os.path.join(self.directory, 'objects', digest[:2], digest[2:])
+
+    def _write_object(self, digest, raw):
+        path = self._object_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = zlib.compress(raw, 6)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        return len(data)
+
+    def _read_object(self, digest):
+        try:
+            with open(self._object_path(digest), 'rb') as f:
+                return zlib.decompress(f.read())
+        except (OSError, zlib.error) as e:
+            self.logger.warning(f"Cached message {digest[:12]} unreadable: {str(e)}")
+            return None
@@ -0,0 +1,85 @@
+import contextvars
+import logging
+import queue
+import threading
+
+_STOP = object()
+
+
+class Pipeline:
+    """
+    Runs work items through a chain of stages connected by bounded queues.
+    Every stage has its own pool of worker threads, so a slow stage (e.g. the
+    network fetch) overlaps with the ones after it, and memory is bounded by
+    queue_size items waiting between each pair of stages.
+
+    A stage function takes an item and returns the item for the next stage, or
+    None to drop it. Exceptions are logged and the item is dropped.
+    """
+
+    def __init__(self, queue_size=4):
+        self.queue_size = queue_size
+        self.stages = []
+        self.logger = logging.getLogger(__name__)
+
+    def add_stage(self, name, func, workers=1):
+        self.stages.append((name, func, max(int(workers), 1)))
+        return self
+
+    def run(self, source, source_workers=1):
+        """
+        Feed the pipeline from source(worker_index), a generator function run in
+        source_workers threads, and block until every item has passed all stages.
+        """
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in self.stages]
+
+        source_threads = [
+            self._start(self._run_source, source, index, queues[0] if queues else None)
+            for index in range(max(int(source_workers), 1))
+        ]
+        stage_threads = []
+        for position, (name, func, workers) in enumerate(self.stages):
+            output = queues[position + 1] if position + 1 < len(queues) else None
+            stage_threads.append([
+                self._start(self._run_stage, name, func, queues[position], output)
+                for _ in range(workers)
+            ])
+
+        # Shut down stage by stage: once all producers of a queue are done,
+        # send one stop marker per consumer
+        for thread in source_threads:
+            thread.join()
+        for position, threads in enumerate(stage_threads):
+            for _ in threads:
+                queues[position].put(_STOP)
+            for thread in threads:
+                thread.join()
+
+    @staticmethod
+    def _start(target, *args):
+        # Run workers in a copy of the caller's context so log context variables carry over
+        context = contextvars.copy_context()
+        thread = threading.Thread(target=context.run, args=(target,) + args, daemon=True)
+        thread.start()
+        return thread
+
+    def _run_source(self, source, index, output):
+        try:
+            for item in source(index):
+                if output is not None:
+                    output.put(item)
+        except Exception as e:
+            self.logger.error(f"Pipeline source {index} stopped: {str(e)}")
+
+    def _run_stage(self, name, func, input_queue, output):
+        while True:
+            item = input_queue.get()
+            if item is _STOP:
+                return
+            try:
+                result = func(item)
+            except Exception as e:
+                self.logger.error(f"Pipeline stage '{name}' failed: {str(e)}")
+                continue
+            if result is not None and output is not None:
+                output.put(result)
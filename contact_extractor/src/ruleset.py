@@ -0,0 +1,256 @@
+import hashlib
+import json
+import re
+
+DOMAIN_STRATEGIES = ('whitelist', 'blacklist', 'hybrid')
+PATTERN_KEYS = ('always_blacklist', 'always_whitelist', 'whitelist_domains', 'blacklist_patterns')
+BACKREFERENCE = re.compile(r'\\[1-9]|\(\?P=')
+REGEX_METACHARACTERS = frozenset('.^$*+?{}[]\\|()')
+# Wildcard prefixes of suffix rules: '.*\.example\.com', '.+@example\.com', '(.*\.)?example\.com'
+SUFFIX_RULE = re.compile(r'(\.\*|\.\+|\((?:\?:)?\.\*\\\.\)\?)(.+)', re.DOTALL)
+
+
+class PatternList:
+    """
+    A list of rules.yaml regexes, compiled once. Patterns that are really
+    literal domains ('acme\\.com') or wildcard suffixes ('.*\\.acme\\.com') are
+    moved into hash lookups, so they cost one dict probe per label of the text
+    however many there are. The remaining patterns are matched through a single
+    alternation, one regex call per lookup instead of one per pattern.
+    """
+
+    def __init__(self, key, patterns):
+        self.key = key
+        self.patterns = tuple(patterns)
+        compiled = {}
+        for pattern in self.patterns:
+            try:
+                compiled[pattern] = re.compile(pattern)
+            except re.error as e:
+                raise ValueError(f"Invalid pattern {pattern!r} in {key}: {e}")
+
+        # literal text -> pattern, and suffix -> (minimum length of the wildcard part before it, pattern)
+        self._exact = {}
+        self._suffixes = {}
+        complex_patterns = [p for p in self.patterns if not self._index(p)]
+        self._complex = tuple((pattern, compiled[pattern]) for pattern in complex_patterns)
+        self._suffix_starts = ''.join(sorted({suffix[0] for suffix in self._suffixes}))
+
+        # Patterns with backreferences or inline global flags change meaning or
+        # fail to compile inside an alternation, so those are matched one by one
+        joinable = [p for p in complex_patterns if self._joinable(p)]
+        self._combined = None
+        if len(joinable) > 1:
+            try:
+                self._combined = re.compile('|'.join(f'(?:{p})' for p in joinable))
+            except re.error:
+                pass
+        joined = set(joinable) if self._combined is not None else set()
+        self._separate = tuple(regex for pattern, regex in self._complex if pattern not in joined)
+
+    def _index(self, pattern):
+        """Add pattern to the hash lookups if it is a literal or a wildcard suffix; False if it is neither."""
+        literal = self._literal(pattern)
+        if literal is not None:
+            self._exact.setdefault(literal, pattern)
+            return True
+        match = SUFFIX_RULE.fullmatch(pattern)
+        suffix = self._literal(match.group(2)) if match else None
+        if not suffix:
+            return False
+        wildcard = match.group(1)
+        if wildcard.startswith('('):
+            # (.*\.)?example\.com: the domain itself or any subdomain of it
+            self._exact.setdefault(suffix, pattern)
+            suffix, min_prefix = '.' + suffix, 0
+        else:
+            min_prefix = 1 if wildcard == '.+' else 0
+        if suffix not in self._suffixes or min_prefix < self._suffixes[suffix][0]:
+            self._suffixes[suffix] = (min_prefix, pattern)
+        return True
+
+    @staticmethod
+    def _literal(pattern):
+        """The text pattern matches if it contains no regex syntax besides escapes, else None."""
+        chars = []
+        index = 0
+        while index < len(pattern):
+            char = pattern[index]
+            if char == '\\':
+                escaped = pattern[index + 1:index + 2]
+                if not escaped or escaped.isalnum() or escaped.isspace():
+                    return None
+                chars.append(escaped)
+                index += 2
+            elif char in REGEX_METACHARACTERS or char.isspace():
+                return None
+            else:
+                chars.append(char)
+                index += 1
+        return ''.join(chars)
+
+    def _indexed_match(self, text):
+        """The literal or suffix pattern matching text, or None."""
+        # '.' never matches a newline, and literals contain no whitespace
+        if '\n' in text:
+            return None
+        if text in self._exact:
+            return self._exact[text]
+        for start in self._suffix_starts:
+            index = text.find(start)
+            while index != -1:
+                entry = self._suffixes.get(text[index:])
+                if entry is not None and index >= entry[0]:
+                    return entry[1]
+                index = text.find(start, index + 1)
+        return None
+
+    @staticmethod
+    def _joinable(pattern):
+        if BACKREFERENCE.search(pattern):
+            return False
+        try:
+            re.compile(f'(?:{pattern})')
+            return True
+        except re.error:
+            return False
+
+    def fullmatch(self, text):
+        if self._indexed_match(text) is not None:
+            return True
+        if self._combined is not None and self._combined.fullmatch(text):
+            return True
+        return any(regex.fullmatch(text) for regex in self._separate)
+
+    def first_match(self, text):
+        """A pattern that matches the whole of text, or None (for log messages)."""
+        pattern = self._indexed_match(text)
+        if pattern is not None or not self.fullmatch(text):
+            return pattern
+        return next(p for p, regex in self._complex if regex.fullmatch(text))
+
+    def __len__(self):
+        return len(self.patterns)
+
+
+class KeywordMatcher:
+    """
+    Finds any of a set of lowercase keywords in a single pass over a text.
+    The keywords are merged into a trie and the trie is compiled into one
+    regex, so at each text position the regex engine follows one trie path
+    instead of testing every keyword; the cost grows with the text and the
+    longest keyword, not with the number of keywords. Texts must already be
+    lowercased.
+    """
+
+    def __init__(self, keywords):
+        self.keywords = tuple(dict.fromkeys(keywords))
+        self._keyword_set = frozenset(self.keywords)
+        pattern = self._trie_pattern(self.keywords)
+        self._search = re.compile(pattern) if self.keywords else None
+        # Zero-width lookahead so finditer reports a match at every position, overlapping ones included
+        self._scan = re.compile(f'(?=({pattern}))') if self.keywords else None
+
+    @classmethod
+    def _trie_pattern(cls, keywords):
+        trie = {}
+        for keyword in keywords:
+            node = trie
+            for char in keyword:
+                node = node.setdefault(char, {})
+            node[''] = {}
+        return cls._node_pattern(trie)
+
+    @classmethod
+    def _node_pattern(cls, node):
+        branches = [re.escape(char) + cls._node_pattern(child) for char, child in sorted(node.items()) if char]
+        if not branches:
+            return ''
+        pattern = branches[0] if len(branches) == 1 else f"(?:{'|'.join(branches)})"
+        # A keyword ending here makes the rest optional; greedy matching still prefers the longer keyword
+        return f'(?:{pattern})?' if '' in node else pattern
+
+    def search(self, text):
+        """True if any keyword occurs in text."""
+        return self._search is not None and self._search.search(text) is not None
+
+    def hits(self, text):
+        """Every keyword that occurs in text, in rules.yaml order."""
+        if self._scan is None:
+            return []
+        found = set()
+        for match in self._scan.finditer(text):
+            word = match.group(1)
+            # The longest keyword starting here was matched; shorter keywords that are its prefixes hit too
+            found.update(word[:end] for end in range(len(word) + 1) if word[:end] in self._keyword_set)
+        return [keyword for keyword in self.keywords if keyword in found]
+
+    def __len__(self):
+        return len(self.keywords)
+
+
+class RuleSet:
+    """
+    Validated, compiled form of rules.yaml. Patterns are compiled once,
+    keywords are lowercased once into a KeywordMatcher, and the object is read-only so one instance
+    can be shared between threads. get() returns the original values for code
+    that works on the raw rules, such as build_search_filter.
+
+    Raises ValueError when the rules do not follow the rules.yaml schema.
+    """
+
+    def __init__(self, rules=None):
+        rules = {} if rules is None else rules
+        if not isinstance(rules, dict):
+            raise ValueError(f"rules must be a mapping, got {type(rules).__name__}")
+        self._rules = dict(rules)
+        # Identifies these rules in caches of earlier verdicts (see DomainVerdictCache)
+        self.digest = hashlib.sha256(json.dumps(self._rules, sort_keys=True, default=str).encode()).hexdigest()
+
+        self.keywords = tuple(k.lower() for k in self._string_list('recruiter_keywords'))
+        self.keyword_matcher = KeywordMatcher(self.keywords)
+        self.domain_strategy = rules.get('domain_strategy') or 'hybrid'
+        if self.domain_strategy not in DOMAIN_STRATEGIES:
+            raise ValueError(
+                f"domain_strategy must be one of {', '.join(DOMAIN_STRATEGIES)}, got {self.domain_strategy!r}"
+            )
+        for key in PATTERN_KEYS:
+            setattr(self, key, PatternList(key, self._string_list(key)))
+
+        signature_patterns = rules.get('signature_patterns') or {}
+        if not isinstance(signature_patterns, dict):
+            raise ValueError("signature_patterns must be a mapping")
+        self.phone_patterns = self._compile_all('signature_patterns.phone', signature_patterns.get('phone'))
+        self.linkedin_patterns = self._compile_all('signature_patterns.linkedin', signature_patterns.get('linkedin'))
+        self._frozen = True
+
+    def _string_list(self, key):
+        values = self._rules.get(key) or []
+        if not isinstance(values, list) or not all(isinstance(v, (str, int, float)) for v in values):
+            raise ValueError(f"{key} must be a list of strings")
+        return [str(v) for v in values]
+
+    @staticmethod
+    def _compile_all(key, patterns):
+        if not patterns:
+            return ()
+        if not isinstance(patterns, list):
+            raise ValueError(f"{key} must be a list of strings")
+        try:
+            return tuple(re.compile(str(p)) for p in patterns)
+        except re.error as e:
+            raise ValueError(f"Invalid pattern in {key}: {e}")
+
+    def get(self, key, default=None):
+        return self._rules.get(key, default)
+
+    def keys(self):
+        return self._rules.keys()
+
+    def __bool__(self):
+        return bool(self._rules)
+
+    def __setattr__(self, name, value):
+        if getattr(self, '_frozen', False):
+            raise AttributeError("RuleSet is read-only")
+        super().__setattr__(name, value)
@@ -1,6 +1,7 @@
 import csv
 import json
 import os
+import threading
 from datetime import datetime
 import logging
 
@@ -14,6 +15,9 @@ class StorageManager:
         self.last_run_path = os.path.join(self.data_dir, 'last_run.json')
         # Ensure data directory exists, but do not create extracted_contacts here
         os.makedirs(self.data_dir, exist_ok=True)
+        # Serializes CSV appends and last_run.json read-modify-write cycles
+        # when several accounts are processed from worker threads
+        self._lock = threading.RLock()
 
     def save_contacts(self, email_account: str, contacts: list):
         """Save contacts to a single CSV file (output.csv), skipping duplicates already saved"""
@@ -21,15 +25,26 @@ class StorageManager:
             self.logger.info(f"No contacts to save for {email_account}")
             return
 
+        with self._lock:
+            self._append_contacts(contacts)
+
+    def _append_contacts(self, contacts: list):
         output_csv = os.path.join(self.data_dir, 'output.csv')
         file_exists = os.path.isfile(output_csv)
 
+        fieldnames = [
+            'name', 'email', 'phone', 'company',
+            'website', 'source', 'linkedin_id', 'extracted_date', 'body_truncated'
+        ]
+
         # --- Load existing emails for deduplication ---
         existing_emails = set()
         if file_exists:
             try:
                 with open(output_csv, 'r', encoding='utf-8') as csvfile:
                     reader = csv.DictReader(csvfile)
+                    # Keep appending in the layout the file was created with
+                    fieldnames = reader.fieldnames or fieldnames
                     for row in reader:
                         email = (row['email'] or '').strip().lower()
                         existing_emails.add(email)
@@ -38,11 +53,7 @@ class StorageManager:
 
         try:
             with open(output_csv, 'a', newline='', encoding='utf-8') as csvfile:
-                fieldnames = [
-                    'name', 'email', 'phone', 'company', 
-                    'website', 'source', 'linkedin_id', 'extracted_date'
-                ]
-                writer = csv.DictWriter(csvfile, fieldnames=fieldnames)
+                writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
                 if not file_exists:
                     writer.writeheader()
                 new_count = 0
@@ -66,24 +77,52 @@ class StorageManager:
     def load_last_run(self):
         """Load last run information"""
         try:
-            if os.path.exists(self.last_run_path):
-                with open(self.last_run_path, 'r') as f:
-                    return json.load(f)
+            with self._lock:
+                if os.path.exists(self.last_run_path):
+                    with open(self.last_run_path, 'r') as f:
+                        return json.load(f)
             return {}
         except Exception as e:
             self.logger.error(f"Error loading last run data: {str(e)}")
             return {}
 
-    def save_last_run(self, email_account: str, last_uid: str):
-        """Save last processed email UID"""
+    def save_last_run(self, email_account: str, last_uid: str, pending_uids: str = '', mailbox_state: dict = None):
+        """
+        Save the highest UID already searched and the message set of UIDs from
+        that search still waiting to be processed, so an interrupted run resumes
+        without searching again or skipping older mail. mailbox_state records
+        the UIDVALIDITY and HIGHESTMODSEQ those UIDs belong to.
+        """
+        try:
+            with self._lock:
+                data = self.load_last_run()
+                entry = data.get(email_account, {})
+                entry.update({
+                    'last_uid': last_uid,
+                    'pending_uids': pending_uids,
+                    'last_run': datetime.now().isoformat()
+                })
+                if mailbox_state is not None:
+                    entry['uidvalidity'] = mailbox_state.get('uidvalidity')
+                    entry['highestmodseq'] = mailbox_state.get('highestmodseq')
+                data[email_account] = entry
+
+                with open(self.last_run_path, 'w') as f:
+                    json.dump(data, f, indent=2)
+        except Exception as e:
+            self.logger.error(f"Error saving last run data: {str(e)}")
+
+    def save_replay_report(self, rows: list):
+        """Write the contact differences found by a rules replay to replay_diff.csv, replacing any earlier report"""
+        report_csv = os.path.join(self.data_dir, 'replay_diff.csv')
+        fieldnames = ['change', 'email', 'name', 'company', 'source', 'details']
         try:
-            data = self.load_last_run()
-            data[email_account] = {
-                'last_uid': last_uid,
-                'last_run': datetime.now().isoformat()
-            }
-            
-            with open(self.last_run_path, 'w') as f:
-                json.dump(data, f, indent=2)
+            with self._lock, open(report_csv, 'w', newline='', encoding='utf-8') as csvfile:
+                writer = csv.DictWriter(csvfile, fieldnames=fieldnames, extrasaction='ignore')
+                writer.writeheader()
+                writer.writerows(rows)
+            self.logger.info(f"Saved {len(rows)} replay differences to {report_csv}")
+            return report_csv
         except Exception as e:
-            self.logger.error(f"Error saving last run data: {str(e)}")
\ No newline at end of file
+            self.logger.error(f"Error saving replay report: {str(e)}")
+            return None
@@ -0,0 +1,80 @@
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+
+DOMAIN_CACHE_SIZE = 50000
+
+
+class DomainVerdictCache:
+    """
+    Bounded LRU of sender domain verdicts keyed by (rules digest, domain), so
+    a domain seen again under the same rules costs one dict lookup instead of
+    a run through the whitelist/blacklist patterns. Editing rules.yaml changes
+    the digest, which makes every older verdict unreachable.
+
+    With a path, verdicts for one digest are loaded at start-up and written
+    back by save(), giving the next run a warm cache.
+    """
+
+    def __init__(self, max_entries=DOMAIN_CACHE_SIZE, path=None):
+        self.max_entries = max_entries
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.logger = logging.getLogger(__name__)
+        if path:
+            self._load()
+
+    def get(self, digest, domain):
+        """The cached verdict for domain under the rules with this digest, or None."""
+        key = (digest, domain)
+        with self._lock:
+            verdict = self._entries.get(key)
+            if verdict is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return verdict
+
+    def put(self, digest, domain, verdict):
+        with self._lock:
+            self._entries[(digest, domain)] = bool(verdict)
+            self._entries.move_to_end((digest, domain))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def save(self, digest):
+        """Write the verdicts for digest to path, least recently used first."""
+        if not self.path:
+            return
+        with self._lock:
+            verdicts = {domain: verdict for (key, domain), verdict in self._entries.items() if key == digest}
+        try:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                json.dump({'rules_digest': digest, 'verdicts': verdicts}, f)
+            os.replace(tmp_path, self.path)
+            self.logger.info(
+                f"Saved {len(verdicts)} domain verdicts to {self.path} "
+                f"({self.hits} cache hits, {self.misses} misses this run)"
+            )
+        except Exception as e:
+            self.logger.error(f"Error saving domain verdicts: {str(e)}")
+
+    def _load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            digest = data['rules_digest']
+            for domain, verdict in list(data['verdicts'].items())[-self.max_entries:]:
+                self._entries[(digest, domain)] = bool(verdict)
+            self.logger.info(f"Loaded {len(self._entries)} domain verdicts from {self.path}")
+        except Exception as e:
+            self.logger.error(f"Error loading domain verdicts: {str(e)}")
@@ -0,0 +1,81 @@
+import email
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from extractor import ContactExtractor
+
+# Per-process extractor, built once by init_worker so rules are loaded and
+# compiled once per worker rather than shipped with every task
+_extractor = None
+# (baseline, new) extractors for replay workers, see init_replay_worker
+_replay_extractors = None
+
+
+def init_worker():
+    global _extractor
+    _extractor = ContactExtractor()
+
+
+def classify_raw(raw, source_email):
+    """
+    Parse one raw message, classify it and extract its contact inside a worker
+    process. Only the small verdict and contact dict are pickled back.
+    Returns (sender, is_recruiter, contact).
+    """
+    message = email.message_from_bytes(raw)
+    sender = message.get('From')
+    try:
+        if not _extractor.is_recruiter_email(message):
+            return sender, False, None
+        return sender, True, _extractor.extract_contacts(message, source_email=source_email)
+    except Exception as e:
+        logging.getLogger(__name__).error(f"Error classifying email from {sender}: {str(e)}")
+        return sender, False, None
+
+
+def init_replay_worker(baseline_rules_path, rules_path):
+    global _replay_extractors
+    _replay_extractors = (ContactExtractor(baseline_rules_path), ContactExtractor(rules_path))
+
+
+def replay_raw(raw, source_email):
+    """
+    Parse one raw message once and evaluate it under both the baseline and
+    the new rules. Returns (sender, baseline_contact, new_contact), where a
+    contact is None if that rule set rejects the message.
+    """
+    message = email.message_from_bytes(raw)
+    sender = message.get('From')
+    verdicts = []
+    for extractor in _replay_extractors:
+        try:
+            contact = None
+            if extractor.is_recruiter_email(message):
+                contact = extractor.extract_contacts(message, source_email=source_email)
+            verdicts.append(contact if contact and contact.get('email') else None)
+        except Exception as e:
+            logging.getLogger(__name__).error(f"Error replaying email from {sender}: {str(e)}")
+            verdicts.append(None)
+    return sender, verdicts[0], verdicts[1]
+
+
+def _start_context():
+    # Workers start lazily on the first submit, which comes from an account,
+    # shard or pipeline thread. A forked child could inherit a logging or
+    # threading lock held by another thread and deadlock, so never fork.
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def create_process_pool(processes):
+    """Create a ProcessPoolExecutor whose workers each hold a pre-loaded ContactExtractor."""
+    return ProcessPoolExecutor(max_workers=processes, mp_context=_start_context(), initializer=init_worker)
+
+
+def create_replay_pool(processes, baseline_rules_path, rules_path):
+    """Create a ProcessPoolExecutor whose workers hold extractors for both rule sets being compared."""
+    return ProcessPoolExecutor(
+        max_workers=processes, mp_context=_start_context(), initializer=init_replay_worker,
+        initargs=(baseline_rules_path, rules_path)
+    )
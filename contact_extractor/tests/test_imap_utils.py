@@ -0,0 +1,52 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+
+from imap_utils import parse_fetch_response, get_literal, get_size
+
+
+class ParseFetchResponseTest(unittest.TestCase):
+
+    def test_literals_survive_a_later_fetch_for_the_same_uid(self):
+        # CONDSTORE servers report the \Seen set by the fetch in a second FETCH
+        data = [
+            (b'1 (UID 5 RFC822 {7}', b'message'),
+            b')',
+            b'1 (UID 5 MODSEQ (12) FLAGS (\\Seen))',
+        ]
+        records = parse_fetch_response(data)
+        self.assertEqual(list(records), ['5'])
+        self.assertEqual(records['5']['literals']['RFC822'], b'message')
+        self.assertIn(b'FLAGS', records['5']['text'])
+
+    def test_flags_before_data_are_merged(self):
+        data = [
+            b'1 (UID 5 FLAGS ())',
+            (b'1 (UID 5 RFC822.SIZE 7 BODY[HEADER.FIELDS (FROM)] {7}', b'From: a'),
+            b')',
+        ]
+        record = parse_fetch_response(data)['5']
+        self.assertEqual(get_literal(record, 'BODY[HEADER'), b'From: a')
+        self.assertEqual(get_size(record), 7)
+
+    def test_uid_is_read_from_top_level_items_only(self):
+        data = [
+            b'1 (BODYSTRUCTURE ("text" "plain" ("name" "UID 9") NIL NIL "7bit" 4 1) UID 5)',
+        ]
+        self.assertEqual(list(parse_fetch_response(data)), ['5'])
+
+    def test_uid_inside_a_section_name_is_ignored(self):
+        data = [
+            (b'1 (BODY[HEADER.FIELDS (UID 9)] {2}', b'\r\n'),
+            b' UID 5)',
+        ]
+        self.assertEqual(list(parse_fetch_response(data)), ['5'])
+
+    def test_fetch_without_uid_is_skipped(self):
+        self.assertEqual(parse_fetch_response([b'3 (FLAGS (\\Seen))']), {})
+
+
+if __name__ == '__main__':
+    unittest.main()